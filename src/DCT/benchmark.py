@@ -0,0 +1,221 @@
+import contextlib, json, os, platform, sys, tempfile, time, tracemalloc
+import numpy as np
+from functools import partial
+import main
+from simulator import SimulatedStream, sensor_time_now
+
+""" Benchmark of the Data Collection Tool hot paths.
+
+Measures throughput and peak memory of the frame decoders (parse_frame), the timestamp conversion
+(convert_ulong_to_timestamp, format_timestamps_iso) and the file writers (write_*_file, binary writer) on
+synthetic PMD frames of realistic size, and estimates how many sensors one core can sustain. Results are
+printed as JSON.
+
+Usage:
+    python3 benchmark.py [--frames=N] [--repeat=R] [--output=results.json]
+"""
+
+## Stream configurations benchmarked: sample frequency [Hz] and resolution [bits] (ECG: 130 Hz, 14 bit, 73 samples per frame)
+BENCH_STREAMS = {
+    "ECG": (130, 14),
+    "PPG": (130, 22),
+    "ACC": (200, 16),
+    "PPI": (1, 0),
+    "GYR": (200, 16),
+    "MAG": (100, 16),
+}
+
+
+def synthetic_frames(meas_type: str, count: int) -> list:
+    sample_freq, resolution = BENCH_STREAMS[meas_type]
+    source = SimulatedStream(meas_type, sample_freq, sensor_time_now(), resolution)
+    return [source.next_frame() for _ in range(count)]
+
+def samples_per_frame(meas_type: str) -> int:
+    return SimulatedStream(meas_type, BENCH_STREAMS[meas_type][0], 0).samples_per_frame
+
+def timed(function, repeat: int) -> float:
+    # best of repeat runs [s]; function must restore its own preconditions
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+def peak_memory(function) -> int:
+    tracemalloc.start()
+    try:
+        function()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+def bench_stream(meas_type: str) -> main.SensorStream:
+    sample_freq, resolution = BENCH_STREAMS[meas_type]
+    return main.SensorStream(main.PolarDataStreamSettings(meas_type, sample_freq, resolution))
+
+def bench_parser(meas_type: str, frames: list, repeat: int) -> dict:
+    stream = bench_stream(meas_type)
+    decoders = main.build_decoders({meas_type: stream})
+
+    def run() -> None:
+        for frame in frames:
+            main.parse_frame(frame, decoders)
+        stream.buffer.drain()
+
+    seconds = timed(run, repeat)
+    samples = len(frames) * samples_per_frame(meas_type)
+    return {
+        "name": f"parse_frame[{meas_type}]",
+        "frames": len(frames),
+        "seconds": seconds,
+        "frames_per_sec": len(frames) / seconds,
+        "samples_per_sec": samples / seconds,
+        "peak_memory_bytes": peak_memory(run),
+    }
+
+def bench_writer(meas_type: str, frames: list, repeat: int, output_dir: str, output_format: str) -> dict:
+    stream = bench_stream(meas_type)
+    decoders = main.build_decoders({meas_type: stream})
+    main.output_format = output_format
+
+    for frame in frames:
+        main.parse_frame(frame, decoders)
+    block = stream.buffer.drain()
+    samples = 0 if block is None else len(block[0])
+    base = os.path.join(output_dir, f"bench_{meas_type}_{output_format}")
+
+    def open_output() -> tuple:
+        f, write = main.open_stream_output(base, stream)
+        stream.file_header_trigger = True
+        return f, partial(write, block)
+
+    def bytes_written(f) -> int:
+        f.flush()
+        if output_format == "bin":
+            return sum(column.tell() for column in f.files)
+        return f.tell()
+
+    best = float("inf")
+    for _ in range(repeat):
+        f, flush = open_output()
+        start = time.perf_counter()
+        flush()
+        best = min(best, time.perf_counter() - start)
+        written = bytes_written(f)
+        f.close()
+    f, flush = open_output()
+    memory = peak_memory(flush)
+    f.close()
+    main.output_format = "csv"
+
+    name = f"write_{meas_type}_file" if output_format == "csv" else f"write_binary_file[{meas_type}]"
+    return {
+        "name": name,
+        "samples": samples,
+        "seconds": best,
+        "samples_per_sec": samples / best if best > 0 else None,
+        "bytes_written": written,
+        "bytes_per_sec": written / best if best > 0 else None,
+        "peak_memory_bytes": memory,
+    }
+
+def bench_timestamp_conversion(count: int, repeat: int) -> dict:
+    raw = [sensor_time_now() + i * 7_692_307 for i in range(count)]
+
+    def run() -> None:
+        for value in raw:
+            main.convert_ulong_to_timestamp(value)
+
+    seconds = timed(run, repeat)
+    return {
+        "name": main.convert_ulong_to_timestamp.__name__,
+        "samples": count,
+        "seconds": seconds,
+        "samples_per_sec": count / seconds,
+        "peak_memory_bytes": peak_memory(run),
+    }
+
+def bench_timestamp_formatting(count: int, repeat: int) -> dict:
+    # vectorized ISO-8601 formatting of a whole block, as done by the CSV writers with --iso-timestamps
+    raw = sensor_time_now() + np.arange(count, dtype=np.int64) * 7_692_307
+
+    def run() -> None:
+        main.format_timestamps_iso(raw)
+
+    seconds = timed(run, repeat)
+    return {
+        "name": main.format_timestamps_iso.__name__,
+        "samples": count,
+        "seconds": seconds,
+        "samples_per_sec": count / seconds,
+        "peak_memory_bytes": peak_memory(run),
+    }
+
+def sensor_capacity(meas_type: str, parser: dict, writer: dict) -> dict:
+    # CPU seconds needed per second of recording of one sensor, and the resulting sensors per core
+    sample_freq, _ = BENCH_STREAMS[meas_type]
+    if meas_type == "PPI":
+        frames_per_sec = 1.0
+        samples_per_sec = 1.0
+    else:
+        frames_per_sec = sample_freq / samples_per_frame(meas_type)
+        samples_per_sec = sample_freq
+    cost = frames_per_sec / parser["frames_per_sec"]
+    if writer["samples_per_sec"]:
+        cost += samples_per_sec / writer["samples_per_sec"]
+    return {"cpu_seconds_per_sensor_second": cost, "sensors_per_core": 1.0 / cost if cost > 0 else None}
+
+def run_benchmarks(frames: int, repeat: int) -> dict:
+    results = []
+    capacity = {}
+    with tempfile.TemporaryDirectory() as output_dir, open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        for meas_type in BENCH_STREAMS:
+            stream_frames = synthetic_frames(meas_type, frames)
+            parser = bench_parser(meas_type, stream_frames, repeat)
+            csv_writer = bench_writer(meas_type, stream_frames, repeat, output_dir, "csv")
+            bin_writer = bench_writer(meas_type, stream_frames, repeat, output_dir, "bin")
+            results += [parser, csv_writer, bin_writer]
+            capacity[meas_type] = {
+                "csv": sensor_capacity(meas_type, parser, csv_writer),
+                "bin": sensor_capacity(meas_type, parser, bin_writer),
+            }
+        results.append(bench_timestamp_conversion(frames * 73, repeat))
+        results.append(bench_timestamp_formatting(frames * 73, repeat))
+
+    return {
+        "host": {
+            "platform": platform.platform(),
+            "machine": platform.machine(),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "cpu_count": os.cpu_count(),
+        },
+        "config": {"frames": frames, "repeat": repeat, "streams": {k: {"sample_freq": v[0], "resolution": v[1]} for k, v in BENCH_STREAMS.items()}},
+        "results": results,
+        "capacity": capacity,
+    }
+
+
+if __name__ == "__main__":
+    frames = 2000
+    repeat = 5
+    output = None
+    for arg in sys.argv[1:]:
+        if arg.startswith("--frames="):
+            frames = int(arg[arg.index("=") + 1:])
+        elif arg.startswith("--repeat="):
+            repeat = int(arg[arg.index("=") + 1:])
+        elif arg.startswith("--output="):
+            output = arg[arg.index("=") + 1:]
+        else:
+            print(f"Illegal argument: {arg}")
+            sys.exit(1)
+
+    report = json.dumps(run_benchmarks(frames, repeat), indent=2)
+    if output is None:
+        print(report)
+    else:
+        with open(output, "w") as f:
+            f.write(report)
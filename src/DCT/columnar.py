@@ -0,0 +1,127 @@
+import os, struct
+import numpy as np
+
+""" Append-only binary columnar output format of the Data Collection Tool.
+
+Every column of a stream is stored in its own file, {base}.{MEAS}.{column}.bin, holding a fixed size
+header followed by the raw little-endian values. The files can be memory mapped by analysis code
+without any parsing or copying:
+
+    stream = open_stream("data_AABBCCDDEEFF_20220301T120000", "ECG")
+    stream["timestamp"], stream["voltage"]
+    to_datetime64(stream["timestamp"]) # absolute time, only when needed
+"""
+
+COLUMN_MAGIC = b"SENSECOL"
+COLUMN_VERSION = 1
+
+## magic, version, header size, measurement type code, resolution [bits], sample frequency [Hz], range,
+## value dtype (numpy string, e.g. "<i4"), column name (up to 42 bytes UTF-8, zero padded; files of the
+## 16 byte layout with 26 padding bytes read the same)
+COLUMN_HEADER = struct.Struct("<8sHHBBHH4s42s")
+COLUMN_HEADER_SIZE = COLUMN_HEADER.size # 64 bytes
+
+TIMESTAMP_DTYPE = np.dtype("<i8") # raw sensor timestamp, nanoseconds since 2000-01-01T00:00:00Z
+TIMESTAMP_EPOCH = np.datetime64("2000-01-01T00:00:00", "ns")
+VALUE_DTYPE = np.dtype("<i4")
+
+
+def to_datetime64(timestamps: np.ndarray) -> np.ndarray:
+    # Vectorized conversion of raw sensor timestamps to datetime64[ns] (UTC)
+    return TIMESTAMP_EPOCH + np.asarray(timestamps).astype("timedelta64[ns]")
+
+
+def column_path(file_base_name: str, measurement_type: str, column: str) -> str:
+    return f"{file_base_name}.{measurement_type}.{column}.bin"
+
+
+class ColumnHeader:
+    def __init__(self, measurement_code: int, resolution: int, sample_freq: int, range: int, dtype: np.dtype, column: str) -> None:
+        self.measurement_code = measurement_code
+        self.resolution = resolution
+        self.sample_freq = sample_freq
+        self.range = range
+        self.dtype = np.dtype(dtype)
+        self.column = column
+
+    def pack(self) -> bytes:
+        # struct would silently cut the strings to their field size
+        dtype, column = self.dtype.str.encode(), self.column.encode()
+        if len(dtype) > 4:
+            raise ValueError(f"dtype {self.dtype.str} does not fit the column header (4 bytes)")
+        if len(column) > 42:
+            raise ValueError(f"Column name {self.column} does not fit the column header (42 bytes)")
+        return COLUMN_HEADER.pack(
+            COLUMN_MAGIC, COLUMN_VERSION, COLUMN_HEADER_SIZE,
+            self.measurement_code, self.resolution, self.sample_freq, self.range,
+            dtype, column,
+        )
+
+    def unpack(raw: bytes) -> "ColumnHeader":
+        magic, version, header_size, code, resolution, sample_freq, range, dtype, column = COLUMN_HEADER.unpack(raw[:COLUMN_HEADER_SIZE])
+        if magic != COLUMN_MAGIC:
+            raise ValueError("Not a SenSe column file")
+        if version != COLUMN_VERSION or header_size != COLUMN_HEADER_SIZE:
+            raise ValueError(f"Unsupported column file version {version}")
+        return ColumnHeader(code, resolution, sample_freq, range, dtype.rstrip(b"\0").decode(), column.rstrip(b"\0").decode())
+
+
+class BinaryStreamWriter:
+    # Writes one stream as a set of column files. columns: sequence of (name, dtype) in the order of the
+    # sample buffer columns. settings: the PolarDataStreamSettings the stream was started with.
+    # opener: opens a column file for binary writing (default: open(path, "wb")).
+    def __init__(self, file_base_name: str, measurement_code: int, settings, columns: tuple, opener=None) -> None:
+        self.columns = columns
+        self.files = []
+        for name, dtype in columns:
+            header = ColumnHeader(measurement_code, settings.resolution, settings.sample_freq, settings.range, dtype, name)
+            path = column_path(file_base_name, settings.measurement_type, name)
+            f = open(path, "wb") if opener is None else opener(path)
+            f.write(header.pack())
+            self.files.append(f)
+
+    def write(self, block: tuple) -> int:
+        written = 0
+        for (name, dtype), f, values in zip(self.columns, self.files, block):
+            data = np.ascontiguousarray(values, dtype=dtype)
+            f.write(data)
+            written += data.nbytes
+        return written
+
+    def flush(self) -> None:
+        for f in self.files:
+            f.flush()
+
+    def sync(self) -> None:
+        for f in self.files:
+            f.flush()
+            os.fsync(f.fileno())
+
+    def close(self) -> None:
+        for f in self.files:
+            f.close()
+
+
+def open_column(path: str, mode: str = "r") -> tuple:
+    with open(path, "rb") as f:
+        header = ColumnHeader.unpack(f.read(COLUMN_HEADER_SIZE))
+    size = os.path.getsize(path) - COLUMN_HEADER_SIZE
+    length = size // header.dtype.itemsize
+    if length == 0:
+        return header, np.empty(0, dtype=header.dtype)
+    return header, np.memmap(path, dtype=header.dtype, mode=mode, offset=COLUMN_HEADER_SIZE, shape=(length,))
+
+def open_stream(file_base_name: str, measurement_type: str) -> dict:
+    # Memory maps every column of a recorded stream. Columns are truncated to a common length,
+    # so a recording interrupted in the middle of a flush is still consistent.
+    prefix = os.path.basename(f"{file_base_name}.{measurement_type}.")
+    directory = os.path.dirname(file_base_name) or "."
+    columns = {}
+    for name in sorted(os.listdir(directory)):
+        if name.startswith(prefix) and name.endswith(".bin") and name.count(".") == prefix.count(".") + 1:
+            header, values = open_column(os.path.join(directory, name))
+            columns[header.column] = values
+    if len(columns) == 0:
+        raise FileNotFoundError(f"No {measurement_type} columns found for {file_base_name}")
+    length = min(len(values) for values in columns.values())
+    return {column: values[:length] for column, values in columns.items()}
@@ -0,0 +1,138 @@
+import gzip, io, os
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+""" Streaming compression of the Data Collection Tool output (--compress).
+
+Everything written between two end_frame() calls (one flush of the writer thread) becomes one
+independently decompressible frame: a gzip member, a zstd frame or an lz4 frame. Frames are compressed
+on a pool of worker threads and appended in order, so the writer thread only joins the data. Concatenated
+frames are a valid file for the usual tools (gzip -d, zstd -d, lz4 -d), and the time index of the CSV
+output points at frames, so a time window is read by decompressing only its own frames.
+
+gzip uses the standard library; zstd and lz4 need the optional zstandard and lz4 packages.
+"""
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import lz4.frame
+except ImportError:
+    lz4 = None
+
+codec_suffixes = {
+    "gzip": ".gz",
+    "zstd": ".zst",
+    "lz4": ".lz4",
+}
+
+default_levels = {
+    "gzip": 6,
+    "zstd": 3,
+    "lz4": 0,
+}
+
+
+def available_codecs() -> list:
+    return [codec for codec, module in (("gzip", gzip), ("zstd", zstandard), ("lz4", lz4)) if module is not None]
+
+def codec_from_path(path: str) -> str:
+    for codec, suffix in codec_suffixes.items():
+        if path.endswith(suffix):
+            return codec
+    return None
+
+def compressor(codec: str, level: int = None):
+    level = default_levels[codec] if level is None else level
+    if codec == "gzip":
+        return lambda data: gzip.compress(data, compresslevel=level, mtime=0)
+    if codec == "zstd":
+        # ZstdCompressor objects are not thread safe: one per call, they are cheap
+        return lambda data: zstandard.ZstdCompressor(level=level).compress(data)
+    if codec == "lz4":
+        return lambda data: lz4.frame.compress(data, compression_level=level)
+    raise ValueError(f"Unknown compression codec: {codec}")
+
+## Decompresses one frame (or several concatenated frames for gzip)
+def decompress(codec: str, data: bytes) -> bytes:
+    if codec == "gzip":
+        return gzip.decompress(data)
+    if codec == "zstd":
+        return zstandard.ZstdDecompressor().decompress(data)
+    if codec == "lz4":
+        return lz4.frame.decompress(data)
+    raise ValueError(f"Unknown compression codec: {codec}")
+
+## Opens a compressed output file for sequential reading of its decompressed content (all frames)
+def open_decompressed(path: str):
+    codec = codec_from_path(path)
+    if codec == "gzip":
+        return gzip.open(path, "rb")
+    if codec == "zstd":
+        return io.BufferedReader(zstandard.ZstdDecompressor().stream_reader(open(path, "rb"), read_across_frames=True, closefd=True))
+    if codec == "lz4":
+        return lz4.frame.open(path, "rb")
+    return open(path, "rb")
+
+
+## Worker threads shared by all compressed files (zlib, zstd and lz4 release the GIL while compressing)
+compression_workers = min(4, os.cpu_count() or 1)
+compression_pool = None
+def get_compression_pool() -> ThreadPoolExecutor:
+    global compression_pool
+    if compression_pool is None:
+        compression_pool = ThreadPoolExecutor(max_workers=compression_workers, thread_name_prefix="compress")
+    return compression_pool
+
+
+class CompressedFile:
+    # Write-only file (text or bytes) storing its content as a sequence of compressed frames.
+    # on_written(offset, length) of end_frame is called once the frame is in the file, with its position.
+    # f: binary file the frames are written to (default: open(path, "wb")).
+    def __init__(self, path: str, codec: str, level: int = None, max_pending: int = 8, f=None) -> None:
+        self.name = path
+        self.f = open(path, "wb") if f is None else f
+        self.compress = compressor(codec, level)
+        self.max_pending = max_pending
+        self.parts = []
+        self.pending = deque() # (future, on_written) in file order
+        self.position = 0 # compressed bytes in the file
+
+    def write(self, data) -> int:
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+        self.parts.append(data)
+        return len(data)
+
+    def end_frame(self, on_written=None) -> None:
+        if len(self.parts) > 0:
+            data = b"".join(self.parts)
+            self.parts = []
+            self.pending.append((get_compression_pool().submit(self.compress, data), on_written))
+        # bounded number of frames in flight: waits for the oldest when compression falls behind
+        self.write_completed(wait=len(self.pending) > self.max_pending)
+
+    def write_completed(self, wait: bool = False) -> None:
+        while len(self.pending) > 0 and (wait or self.pending[0][0].done()):
+            future, on_written = self.pending.popleft()
+            frame = future.result()
+            self.f.write(frame)
+            if on_written is not None:
+                on_written(self.position, len(frame))
+            self.position += len(frame)
+            wait = wait and len(self.pending) > self.max_pending
+
+    def flush(self) -> None:
+        self.end_frame()
+        self.write_completed(wait=True)
+        self.f.flush()
+
+    def fileno(self) -> int:
+        return self.f.fileno()
+
+    def close(self) -> None:
+        self.flush()
+        self.f.close()
@@ -0,0 +1,129 @@
+import numpy as np
+
+""" Online ECG processing of the Data Collection Tool (--HR).
+
+RPeakDetector runs over the decoded ECG frames as they arrive. Every stage keeps its state between
+blocks, so each frame is processed exactly once, with numpy operations over the whole block, and the detected
+R-peaks do not depend on how the ECG is split into blocks:
+
+    band-pass FIR (5-15 Hz, QRS energy) -> squaring -> moving window integration (150 ms)
+    -> adaptive threshold -> one R-peak per region above the threshold (its maximum)
+
+The detected R-peaks are turned into RR intervals and heart rate, the derived HR stream.
+"""
+
+
+def band_pass_taps(sample_freq: float, low: float, high: float, count: int) -> np.ndarray:
+    # Windowed sinc band-pass FIR (linear phase, delay (count - 1) / 2 samples)
+    n = np.arange(count) - (count - 1) / 2
+    taps = 2 * high / sample_freq * np.sinc(2 * high * n / sample_freq) - 2 * low / sample_freq * np.sinc(2 * low * n / sample_freq)
+    return taps * np.hamming(count)
+
+
+def next_crossing(x: np.ndarray, start: int, stop: int, level: float, above: bool) -> int:
+    # First index in [start, stop) where (x > level) == above, stop if there is none. Searched in growing
+    # steps, so finding the next crossing costs about the distance to it.
+    step = 64
+    while start < stop:
+        end = min(stop, start + step)
+        hits = np.flatnonzero((x[start:end] > level) == above)
+        if len(hits) > 0:
+            return start + int(hits[0])
+        start, step = end, step * 2
+    return stop
+
+
+class StreamingFIR:
+    # FIR filter over consecutive blocks: the last len(taps) - 1 input samples are carried to the next block
+    def __init__(self, taps: np.ndarray) -> None:
+        self.taps = taps
+        self.state = np.zeros(len(taps) - 1)
+
+    def process(self, x: np.ndarray) -> np.ndarray:
+        data = np.concatenate((self.state, x))
+        self.state = data[len(data) - len(self.state):]
+        return np.convolve(data, self.taps, mode="valid") # len(x) output samples
+
+    @property
+    def delay(self) -> float:
+        return (len(self.taps) - 1) / 2
+
+
+class RPeakDetector:
+    def __init__(self, sample_freq: float, low: float = 5.0, high: float = 15.0, window: float = 0.15,
+                 refractory: float = 0.25, learning: float = 2.0, threshold: float = 0.3) -> None:
+        self.band_pass = StreamingFIR(band_pass_taps(sample_freq, low, high, int(sample_freq * 0.2) | 1))
+        window_length = max(1, int(sample_freq * window))
+        self.integrate = StreamingFIR(np.full(window_length, 1.0 / window_length))
+        self.period_ns = 1e9 / sample_freq
+        self.delay_ns = (self.band_pass.delay + self.integrate.delay) * self.period_ns
+        self.refractory_ns = refractory * 1e9
+        self.threshold = threshold
+
+        self.learning_samples = int(sample_freq * learning) # the first samples only set the signal level
+        self.signal_level = 0.0
+        self.in_region = False
+        self.region_max = 0.0
+        self.region_time = 0
+        self.last_peak = None
+        self.decay_ns = 2e9
+        self.decay_from = None # the level decays 2 s after the last R-peak (or the last decay)
+
+    def process(self, values: np.ndarray, timestamps: np.ndarray) -> tuple:
+        # values, timestamps: one block of ECG samples. Returns (RR interval [ms], heart rate [BPM], timestamp)
+        # of every R-peak confirmed in this block, the timestamp being the one of the R-peak.
+        envelope = self.integrate.process(self.band_pass.process(values.astype(np.float64)) ** 2)
+        peak_times = (timestamps - self.delay_ns).astype(np.int64) # time of the sample the envelope stands for
+
+        if self.learning_samples > 0:
+            learned = min(self.learning_samples, len(envelope))
+            self.signal_level = max(self.signal_level, float(envelope[:learned].max(initial=0.0)))
+            self.learning_samples -= learned
+            envelope, peak_times = envelope[learned:], peak_times[learned:]
+            if len(envelope) == 0:
+                return self.derive([])
+
+        peaks = []
+        position, count = 0, len(envelope)
+        while position < count:
+            # threshold and level are constant up to the next region end or the next 2 s without a beat
+            stop = count
+            if self.decay_from is not None:
+                stop = max(position, int(np.searchsorted(peak_times, self.decay_from + self.decay_ns, side="right")))
+            level = self.threshold * self.signal_level
+            if self.in_region:
+                end = next_crossing(envelope, position, stop, level, False)
+                if end > position:
+                    top = position + int(np.argmax(envelope[position:end]))
+                    if envelope[top] > self.region_max:
+                        self.region_max, self.region_time = float(envelope[top]), int(peak_times[top])
+                if end < stop:
+                    peaks.append(self.region_time)
+                    self.signal_level = 0.875 * self.signal_level + 0.125 * self.region_max
+                    self.in_region = False
+                    self.decay_from = self.region_time
+                position = end
+            else:
+                start = next_crossing(envelope, position, stop, level, True)
+                if start < stop:
+                    self.in_region = True
+                    self.region_max, self.region_time = float(envelope[start]), int(peak_times[start])
+                position = start
+            if position == stop < count:
+                # no beat for 2 s: the level was set by an artifact or the amplitude dropped, lower it
+                self.signal_level *= 0.7
+                self.decay_from = int(peak_times[stop])
+        return self.derive(peaks)
+
+    def derive(self, peaks: list) -> tuple:
+        times = []
+        for peak in peaks:
+            if self.last_peak is not None and peak - self.last_peak < self.refractory_ns:
+                continue
+            if self.last_peak is not None:
+                times.append((self.last_peak, peak))
+            self.last_peak = peak
+        pairs = np.array(times, dtype=np.int64).reshape(-1, 2)
+        rr = np.rint((pairs[:, 1] - pairs[:, 0]) / 1e6).astype(np.int32)
+        hr = np.rint(60000.0 / np.maximum(rr, 1)).astype(np.int32)
+        return rr, hr, pairs[:, 1]
@@ -0,0 +1,132 @@
+import struct
+import numpy as np
+from multiprocessing import resource_tracker, shared_memory
+
+""" Live sample feed of the Data Collection Tool (--live).
+
+The writer thread publishes every decoded frame into a shared memory ring buffer per stream, named
+sense_{address without colons}_{MEAS}, as soon as the frame is decoded. Local dashboards and DSP
+processes read the samples from there without any serialization:
+
+    feed = LiveFeedReader(live_feed_name("AA:BB:CC:DD:EE:FF", "ECG"))
+    while True:
+        samples = feed.read() # new samples since the last read, {"voltage": ..., "timestamp": ...}
+
+The writer never waits for readers: the oldest samples are overwritten, and a reader that falls more
+than the ring capacity behind skips the overwritten samples and counts them in feed.lost.
+
+Layout: 64 byte header (magic, version, measurement type code, column count, capacity [samples],
+write cursor [samples written in total], reserve cursor [end of the write in progress], sample frequency
+[Hz]), a 40 byte descriptor per column (name, numpy dtype, offset) and the column rings.
+"""
+
+LIVE_MAGIC = b"SENSERNG"
+LIVE_VERSION = 1
+LIVE_HEADER = struct.Struct("<8sHBBIQQd24x") # magic, version, measurement code, columns, capacity, cursor, reserve, sample frequency
+LIVE_CURSOR_OFFSET = 16
+LIVE_RESERVE_OFFSET = 24
+LIVE_COLUMN = struct.Struct("<24s4sQ4x") # column name, dtype, offset of the ring
+
+
+def live_feed_name(addr: str, measurement_type: str) -> str:
+    return f"sense_{addr.replace(':', '')}_{measurement_type}"
+
+def column_rings(buffer, columns: list, capacity: int) -> list:
+    return [np.ndarray((capacity,), dtype=dtype, buffer=buffer, offset=offset) for _, dtype, offset in columns]
+
+
+class LiveFeedWriter:
+    # columns: sequence of (name, dtype) in the order of the sample buffer columns
+    def __init__(self, name: str, measurement_code: int, sample_freq: float, columns: tuple, capacity: int) -> None:
+        offset = LIVE_HEADER.size + LIVE_COLUMN.size * len(columns)
+        layout = []
+        for column, dtype in columns:
+            dtype = np.dtype(dtype)
+            layout.append((column, dtype, offset))
+            offset += (capacity * dtype.itemsize + 7) // 8 * 8
+        try:
+            self.shm = shared_memory.SharedMemory(name, create=True, size=offset)
+        except FileExistsError:
+            # left behind by a recording that was killed
+            stale = shared_memory.SharedMemory(name)
+            stale.close()
+            stale.unlink()
+            self.shm = shared_memory.SharedMemory(name, create=True, size=offset)
+
+        LIVE_HEADER.pack_into(self.shm.buf, 0, LIVE_MAGIC, LIVE_VERSION, measurement_code, len(columns), capacity, 0, 0, sample_freq)
+        for i, (column, dtype, column_offset) in enumerate(layout):
+            LIVE_COLUMN.pack_into(self.shm.buf, LIVE_HEADER.size + i * LIVE_COLUMN.size, column.encode(), dtype.str.encode(), column_offset)
+        self.name = name
+        self.capacity = capacity
+        self.rings = column_rings(self.shm.buf, layout, capacity)
+        self.cursor = np.ndarray((1,), dtype="<u8", buffer=self.shm.buf, offset=LIVE_CURSOR_OFFSET)
+        self.reserve = np.ndarray((1,), dtype="<u8", buffer=self.shm.buf, offset=LIVE_RESERVE_OFFSET)
+        self.written = 0
+
+    def publish(self, block: tuple) -> None:
+        n = len(block[0])
+        if n > self.capacity:
+            # only the newest capacity samples can be held
+            self.written += n - self.capacity
+            block = tuple(values[n - self.capacity:] for values in block)
+            n = self.capacity
+        self.reserve[0] = self.written + n # announced before the oldest samples are overwritten
+        start = self.written % self.capacity
+        first = min(n, self.capacity - start)
+        for ring, values in zip(self.rings, block):
+            ring[start:start + first] = values[:first]
+            ring[:n - first] = values[first:]
+        self.written += n
+        self.cursor[0] = self.written # published after the samples
+
+    def close(self) -> None:
+        del self.rings, self.cursor, self.reserve # release the exported buffers before closing
+        self.shm.close()
+        self.shm.unlink()
+
+
+class LiveFeedReader:
+    def __init__(self, name: str, from_start: bool = False) -> None:
+        self.shm = shared_memory.SharedMemory(name)
+        # the feed belongs to the recording process: do not let this process' resource tracker unlink it
+        resource_tracker.unregister(self.shm._name, "shared_memory")
+        magic, version, code, column_count, capacity, cursor, _, sample_freq = LIVE_HEADER.unpack_from(self.shm.buf, 0)
+        if magic != LIVE_MAGIC or version != LIVE_VERSION:
+            raise ValueError(f"{name} is not a SenSe live feed")
+        layout = []
+        for i in range(column_count):
+            column, dtype, offset = LIVE_COLUMN.unpack_from(self.shm.buf, LIVE_HEADER.size + i * LIVE_COLUMN.size)
+            layout.append((column.rstrip(b"\0").decode(), np.dtype(dtype.rstrip(b"\0").decode()), offset))
+        self.measurement_code = code
+        self.sample_freq = sample_freq
+        self.capacity = capacity
+        self.columns = [column for column, _, _ in layout]
+        self.rings = column_rings(self.shm.buf, layout, capacity)
+        self.cursor = np.ndarray((1,), dtype="<u8", buffer=self.shm.buf, offset=LIVE_CURSOR_OFFSET)
+        self.reserve = np.ndarray((1,), dtype="<u8", buffer=self.shm.buf, offset=LIVE_RESERVE_OFFSET)
+        self.position = max(0, int(cursor) - capacity) if from_start else int(cursor)
+        self.lost = 0
+
+    def read(self) -> dict:
+        # Samples published since the last read, as a dict of column name -> array
+        end = int(self.cursor[0])
+        start = max(self.position, end - self.capacity)
+        first, last = start % self.capacity, (end - 1) % self.capacity + 1
+        if end == start:
+            parts = [ring[:0].copy() for ring in self.rings]
+        elif first < last:
+            parts = [ring[first:last].copy() for ring in self.rings]
+        else:
+            parts = [np.concatenate((ring[first:], ring[:last])) for ring in self.rings]
+        # samples the writer overwrote (or started to) while they were copied are dropped
+        overwritten = min(int(self.reserve[0]) - self.capacity - start, end - start)
+        if overwritten > 0:
+            parts = [values[overwritten:] for values in parts]
+            start += overwritten
+        self.lost += start - self.position
+        self.position = end
+        return dict(zip(self.columns, parts))
+
+    def close(self) -> None:
+        del self.rings, self.cursor, self.reserve
+        self.shm.close()
@@ -1,9 +1,27 @@
-import asyncio, os, sys, signal
+import asyncio, os, sys, signal, struct, queue, threading, time
+import numpy as np
 from logging import fatal
 from io import TextIOBase
+from itertools import chain
+from collections import deque
+from functools import partial
+from concurrent.futures import Future, ProcessPoolExecutor
 from datetime import datetime, timedelta, timezone
 from bleak import BleakClient
 from bleak.uuids import uuid16_dict
+from columnar import BinaryStreamWriter, TIMESTAMP_DTYPE, VALUE_DTYPE, to_datetime64
+from rawlog import RawFrameLog, iter_raw_log_records, split_raw_log
+from simulator import SimulatedPolarClient, simulated_addresses
+from metrics import DeviceMetrics, MetricsExporter, StreamMetrics
+from manifest import ChecksumFile, OutputManifest, manifest_path, read_manifest
+from timeindex import TimeIndexWriter, index_path
+import compression
+from compression import CompressedFile
+from livefeed import LiveFeedWriter, live_feed_name
+from ecgdsp import RPeakDetector
+from summary import StreamSummary
+from profiling import Profiler
+from settingscache import SETTING_NAMES, load_cache, parse_settings_response, save_cache
 
 """ Predefined UUID (Universal Unique Identifier) mapping are based on Heart Rate GATT service Protocol that most
 Fitness/Heart Rate device manufacturer follow (Polar H10 in this case) to obtain a specific response input from 
@@ -45,19 +63,36 @@ CMD_ECG_STREAM_SETTINGS_READ = bytearray([0x01, 0x00])
 SAMPLING_FREQ_ECG = 130
 
 
-ECG_data_collection_flag = False
-PPG_data_collection_flag = False
-ACC_data_collection_flag = False
-PPI_data_collection_flag = False
-GYR_data_collection_flag = False
-MAG_data_collection_flag = False
+class SampleBuffer:
+    # Column oriented sample store for one stream. Parsers append whole decoded frames,
+    # writers swap out everything collected so far in constant time and get it back as one block.
+    def __init__(self) -> None:
+        self.chunks = []
+        self.pending = 0 # samples waiting to be drained
+        self.appended = 0 # samples appended in total
+
+    def __len__(self) -> int:
+        return self.pending
+
+    def append(self, *columns) -> tuple:
+        # Returns the appended block (the columns as given). Frames without samples are not kept:
+        # drain() never returns an empty block.
+        if len(columns[0]) == 0:
+            return columns
+        self.chunks.append(columns)
+        self.pending += len(columns[0])
+        self.appended += len(columns[0])
+        return columns
+
+    def drain(self) -> tuple:
+        chunks, self.chunks = self.chunks, []
+        self.pending = 0
+        if len(chunks) == 0:
+            return None
+        if len(chunks) == 1:
+            return chunks[0]
+        return tuple(np.concatenate(column) for column in zip(*chunks))
 
-ECG_data_matrix = []
-PPG_data_matrix = []
-ACC_data_matrix = []
-PPI_data_matrix = []
-GYR_data_matrix = []
-MAG_data_matrix = []
 
 
 class PolarDataCodes:
@@ -114,20 +149,25 @@ class PolarDataCodes:
         0x03: "Stop measurement",
     }
     
-    def get_meas_type(code: bytearray) -> str:
-        return {v: k for k,v in PolarDataCodes.meas_type_dict.items()}[code]
+    # Reverse lookups, built once (codes as bytes, bytearrays are not hashable)
+    meas_code_dict = {v: k for k, v in meas_type_dict.items()}
+    sample_freq_code_dict = {bytes(v): k for k, v in sample_freq_dict.items()}
+    sample_res_code_dict = {bytes(v): k for k, v in sample_res_dict.items()}
+    
+    def get_meas_type(code: int) -> str:
+        return PolarDataCodes.meas_code_dict[code]
     
     def get_meas_code(type: str) -> int:
         return PolarDataCodes.meas_type_dict[type]
     
     def get_freq_numb(code: bytearray) -> int:
-        return {v: k for k,v in PolarDataCodes.sample_freq_dict.items()}[code]
+        return PolarDataCodes.sample_freq_code_dict[bytes(code)]
     
     def get_freq_code(numb: int) -> bytearray:
         return PolarDataCodes.sample_freq_dict[numb]
     
     def get_res_numb(code: bytearray) -> int:
-        return {v: k for k,v in PolarDataCodes.sample_res_dict.items()}[code]
+        return PolarDataCodes.sample_res_code_dict[bytes(code)]
     
     def get_res_code(numb: int) -> bytearray:
         return PolarDataCodes.sample_res_dict[numb]
@@ -157,6 +197,13 @@ class PolarDataStreamSettings(PolarDataCodes):
            
         return cmd_array
     
+    def cmd_settings_array(self) -> bytearray:
+        cmd_array = bytearray()
+        cmd_array.append(0x01) # Op code: Get measurement settings
+        cmd_array.append(PolarDataCodes.get_meas_code(self.measurement_type)) # measurement type
+
+        return cmd_array
+
     def cmd_stop_array(self) -> bytearray:
         cmd_array = bytearray()
         cmd_array.append(0x03) # Op code: Stream request header (stop measurement)
@@ -164,6 +211,31 @@ class PolarDataStreamSettings(PolarDataCodes):
         
         return cmd_array
     
+## Default settings of each measurement type, in the order data types are listed on the command line help
+default_stream_settings = {
+    "ECG": PolarDataStreamSettings("ECG", SAMPLING_FREQ_ECG, 14),
+    "ACC": PolarDataStreamSettings("ACC", 100),
+    "PPI": PolarDataStreamSettings("PPI", 100),
+    "PPG": PolarDataStreamSettings("PPG", SAMPLING_FREQ_ECG, 14),
+    "GYR": PolarDataStreamSettings("GYR", SAMPLING_FREQ_ECG, 14),
+    "MAG": PolarDataStreamSettings("MAG", 100),
+}
+
+
+class SensorStream:
+    # State of one measurement stream of one sensor: the settings it was started with (used by the parsers
+    # for sample timestamps and delta frames), decoded samples waiting to be written and the output file.
+    def __init__(self, settings: PolarDataStreamSettings) -> None:
+        self.settings = settings
+        self.buffer = SampleBuffer()
+        self.sample_cntr = 0
+        self.file_header_trigger = True
+        self.output = None
+        self.live = None
+        self.summary = None
+        self.resumed = False # reconnected: the jump to the next decoded frame is recorded as a gap
+        self.metrics = StreamMetrics(None if settings.measurement_type in ("PPI", "HR") else 1e9 / settings.sample_freq)
+
 ## Keyboard Interrupt Handler
 ctrl_stopp = False
 def keyboardInterrupt_handler(signum, frame) -> None:
@@ -186,371 +258,1189 @@ def convert_to_unsigned_int(data: bytes, offset: int, length: int) -> int:
         bytearray(data[offset : offset + length]), byteorder="little", signed=False,
     )
 
-def ECG_parse_msg(data: bytes) -> None:
-    global SAMPLING_FREQ_ECG
-    print("Measurement: ECG")
-    timestamp_raw = convert_to_unsigned_int(data, 1, 8) # nanoseconds since 2000-01-01T00:00:00Z
-                
-    ecg = []
-    step = 3
-    samples = data[10:]
-    offset = 0
-    while offset < len(samples):
-        ecg.append(convert_array_to_signed_int(samples, offset, step))
-        offset += step
-        
-    ECG_data_matrix.extend([(ecg[i],convert_ulong_to_timestamp(timestamp_raw - int((len(ecg) - i - 1) * 1e9 / SAMPLING_FREQ_ECG)),timestamp_raw - int((len(ecg) - i - 1) * 1e9 / SAMPLING_FREQ_ECG)) for i in range(len(ecg))])
-    return
+## Per sampling frequency table of sample time offsets [ns] relative to the last sample in a frame.
+## Entry -1 is the last sample (offset 0), entry -n is the first of n samples.
+sample_offset_tables = {}
+def get_sample_offsets(sample_freq: int, n: int) -> np.ndarray:
+    table = sample_offset_tables.get(sample_freq)
+    if table is None or len(table) < n:
+        size = max(n, 256)
+        table = (np.arange(size - 1, -1, -1, dtype=np.float64) * (1e9 / sample_freq)).astype(np.int64)
+        sample_offset_tables[sample_freq] = table
+    return table[len(table) - n:]
 
-def ACC_parse_msg(data: bytes) -> None:
-    print("Measurement: ACC")
-    timestamp_raw = convert_to_unsigned_int(data, 1, 8) # nanoseconds since 2000-01-01T00:00:00Z
-    print(f"Timestamp: {convert_ulong_to_timestamp(timestamp_raw).isoformat()}")
-    return
+def decode_int24_array(samples: bytes) -> np.ndarray:
+    raw = np.frombuffer(samples, dtype=np.uint8, count=len(samples) - len(samples) % 3).reshape(-1, 3)
+    padded = np.zeros((len(raw), 4), dtype=np.uint8)
+    padded[:, 1:] = raw
+    return padded.view("<i4").ravel() >> 8 # arithmetic shift sign extends the 24 bit value
 
-def PPG_parse_msg(data: bytes) -> None:
-    print("Measurement: PPG")
-    timestamp_raw = convert_to_unsigned_int(data, 1, 8) # nanoseconds since 2000-01-01T00:00:00Z
-    print(f"Timestamp: {convert_ulong_to_timestamp(timestamp_raw).isoformat()}")
-    return
+## PMD data frame header: measurement type, timestamp of the last sample [ns since 2000-01-01T00:00:00Z], frame type
+FRAME_HEADER = struct.Struct("<BQB")
 
-def PPI_parse_msg(data: bytes) -> None:
-    print("Measurement: PPI") #"Heart rate [BPM] (int), Peak-to-pear [ms] (int), Error estimate (int), Invalid measurement (bool), Skin contact (bool), Skin contact status reporting supported (bool), Sensor timestamp [raw] (int), Sensor timestamt [parsed, ISO] (datetime)
-    timestamp_raw = convert_to_unsigned_int(data, 1, 8) # nanoseconds since 2000-01-01T00:00:00Z
-    
-    ppi = []
-    offset = 0
-    step = 6
-    samples = data[10:]
-
-    while offset < len(samples):
-        bpm = convert_array_to_unsigned_int(samples, offset, 1)
-        peak_interval = convert_array_to_unsigned_int(samples, offset + 1, 2)
-        error_estimate = convert_array_to_unsigned_int(samples, offset + 3, 2)
-        flags = convert_array_to_unsigned_int(samples, offset + 5, 1)
-        ecg.append((bpm,peak_interval,error_estimate, flags & 0x01 == 0x01, flags & 0x02 == 0x02, flags & 0x04 == 0x04))
-        offset += step
-
-    PPI_data_matrix.extend([(ppi[i][0], ppi[i][1], ppi[i][2], ppi[i][3], ppi[i][4], ppi[i][5], timestamp_raw, convert_ulong_to_timestamp(timestamp_raw)) for i in range(len(ppi))])
-    #print(f"Timestamp: {convert_ulong_to_timestamp(timestamp_raw).isoformat()}")
-    return
+## Frame decoders. A decoder factory is given the settings of a stream once, when the session is set up, and
+## returns the function decoding one data frame of that stream into the columns of its sample buffer
+## (timestamps last). frame_decoders holds the factory of every supported (measurement type, frame type);
+## further sensor streams are added with register_decoder() without touching the per frame path.
+frame_decoders = {}
 
-def GYR_parse_msg(data: bytes) -> None:
-    print("Measurement: GYR")
-    timestamp_raw = convert_to_unsigned_int(data, 1, 8) # nanoseconds since 2000-01-01T00:00:00Z
-    print(f"Timestamp: {convert_ulong_to_timestamp(timestamp_raw).isoformat()}")
-    return
+def register_decoder(measurement_type: str, frame_types, factory) -> None:
+    for frame_type in frame_types:
+        frame_decoders[(measurement_type, frame_type)] = factory
 
-def MAG_parse_msg(data: bytes) -> None:
-    print("Measurement: MAG")
-    timestamp_raw = convert_to_unsigned_int(data, 1, 8) # nanoseconds since 2000-01-01T00:00:00Z
-    print(f"Timestamp: {convert_ulong_to_timestamp(timestamp_raw).isoformat()}")
-    return
+def ECG_decoder(settings: PolarDataStreamSettings):
+    sample_freq = settings.sample_freq
+    def decode(data: bytes) -> tuple:
+        _, timestamp_raw, _ = FRAME_HEADER.unpack_from(data)
+        values = decode_int24_array(memoryview(data)[FRAME_HEADER.size:])
+        return values, np.int64(timestamp_raw) - get_sample_offsets(sample_freq, len(values))
+    return decode
+
+## Bytes per channel value of the uncompressed frame types, per measurement type and frame type
+uncompressed_sample_bytes = {
+    "ACC": {0x00: 1, 0x01: 2, 0x02: 3},
+    "PPG": {0x00: 3},
+    "GYR": {0x00: 2},
+    "MAG": {0x00: 2},
+}
+
+## Channels per sample of the multi channel streams
+channel_counts = {
+    "ACC": 3,
+    "PPG": 4,
+    "GYR": 3,
+    "MAG": 3,
+}
+
+def decode_signed_array(data: bytes, sample_bytes: int) -> np.ndarray:
+    if sample_bytes == 3:
+        return decode_int24_array(data)
+    dtype = np.dtype(f"<i{sample_bytes}")
+    return np.frombuffer(data, dtype=dtype, count=len(data) // sample_bytes).astype(np.int32)
+
+## Delta compressed frame: one reference sample (channels x ceil(resolution / 8) bytes) followed by blocks of
+## [delta bit width (1 byte), sample count (1 byte), bit packed signed deltas (LSB first)].
+## Every sample is the previous sample plus its delta, so the whole frame is one cumulative sum.
+def decode_delta_frame(payload: bytes, channels: int, resolution: int) -> np.ndarray:
+    payload = memoryview(payload)
+    ref_bytes = (resolution + 7) // 8
+    offset = channels * ref_bytes
+    parts = [decode_signed_array(payload[:offset], ref_bytes).reshape(1, channels)]
+    while offset + 2 <= len(payload):
+        width, count = payload[offset], payload[offset + 1]
+        offset += 2
+        bit_count = width * channels * count
+        byte_count = (bit_count + 7) // 8
+        if width == 0:
+            deltas = np.zeros(channels * count, dtype=np.int64)
+        else:
+            bits = np.unpackbits(np.frombuffer(payload, dtype=np.uint8, count=byte_count, offset=offset), bitorder="little")
+            deltas = bits[:bit_count].reshape(-1, width).astype(np.int64) @ (np.int64(1) << np.arange(width, dtype=np.int64))
+            deltas -= (deltas >> (width - 1)) << width # two's complement sign extension
+        parts.append(deltas.reshape(count, channels))
+        offset += byte_count
+    return np.cumsum(np.concatenate(parts), axis=0).astype(np.int32)
+
+## Multi channel frames (ACC, PPG, GYR, MAG): one column per channel, then the sample timestamps
+def uncompressed_channel_decoder(channels: int, sample_bytes: int):
+    def factory(settings: PolarDataStreamSettings):
+        sample_freq = settings.sample_freq
+        def decode(data: bytes) -> tuple:
+            _, timestamp_raw, _ = FRAME_HEADER.unpack_from(data)
+            samples = decode_signed_array(memoryview(data)[FRAME_HEADER.size:], sample_bytes)
+            samples = samples[:len(samples) - len(samples) % channels].reshape(-1, channels)
+            return (*samples.T, np.int64(timestamp_raw) - get_sample_offsets(sample_freq, len(samples)))
+        return decode
+    return factory
+
+def delta_channel_decoder(channels: int):
+    def factory(settings: PolarDataStreamSettings):
+        sample_freq, resolution = settings.sample_freq, settings.resolution
+        def decode(data: bytes) -> tuple:
+            _, timestamp_raw, _ = FRAME_HEADER.unpack_from(data)
+            samples = decode_delta_frame(memoryview(data)[FRAME_HEADER.size:], channels, resolution)
+            return (*samples.T, np.int64(timestamp_raw) - get_sample_offsets(sample_freq, len(samples)))
+        return decode
+    return factory
+
+PPI_record_dtype = np.dtype([("bpm", "u1"), ("peak_interval", "<u2"), ("error_estimate", "<u2"), ("flags", "u1")])
+def PPI_decoder(settings: PolarDataStreamSettings):
+    # Heart rate [BPM], peak-to-peak interval [ms], error estimate [ms], invalid measurement, skin contact,
+    # skin contact status reporting supported, all samples with the timestamp of the frame
+    def decode(data: bytes) -> tuple:
+        _, timestamp_raw, _ = FRAME_HEADER.unpack_from(data)
+        samples = memoryview(data)[FRAME_HEADER.size:]
+        ppi = np.frombuffer(samples, dtype=PPI_record_dtype, count=len(samples) // PPI_record_dtype.itemsize)
+        flags = ppi["flags"]
+        return (
+            ppi["bpm"], ppi["peak_interval"], ppi["error_estimate"],
+            flags & 0x01 == 0x01, flags & 0x02 == 0x02, flags & 0x04 == 0x04,
+            np.full(len(ppi), timestamp_raw, dtype=np.int64),
+        )
+    return decode
+
+register_decoder("ECG", (0x00,), ECG_decoder)
+register_decoder("PPI", (0x00,), PPI_decoder)
+for meas, frame_types in uncompressed_sample_bytes.items():
+    for frame_type, sample_bytes in frame_types.items():
+        register_decoder(meas, (frame_type,), uncompressed_channel_decoder(channel_counts[meas], sample_bytes))
+    # frame type bit 7: delta compressed variant of the frame type
+    register_decoder(meas, [0x80 | frame_type for frame_type in frame_types], delta_channel_decoder(channel_counts[meas]))
+
+## Decoders of the streams of one session: (measurement code, frame type) -> (stream, decode function)
+def build_decoders(streams: dict) -> dict:
+    decoders = {}
+    for (meas, frame_type), factory in frame_decoders.items():
+        stream = streams.get(meas)
+        if stream is not None:
+            decoders[(PolarDataCodes.get_meas_code(meas), frame_type)] = (stream, factory(stream.settings))
+    return decoders
+
+## Decoding of one PMD data frame into the sample buffer of its stream, a single table lookup.
+## Returns the stream and the decoded block (its columns, timestamps last).
+def parse_frame(data: bytes, decoders: dict) -> tuple:
+    entry = decoders.get((data[0], data[9]))
+    if entry is None:
+        raise ValueError(f"No decoder for measurement type {hex(data[0])}, frame type {hex(data[9])}")
+    stream, decode = entry
+    return stream, stream.buffer.append(*decode(data))
+
+## Console output of every data packet and asyncio debug mode, --debug. Off in production recordings.
+debug_output = False
+
+## Profiling mode, --profile (see profiling.py): stage timing histograms, slow callbacks, stack samples
+profiler = None
 
 ## Conversion of the binary data stream
-def data_stream_read(sender, data: bytes) -> None:
-    print(f"[{datetime.now().isoformat()}] Data packet length: {len(data)}")        
-    if data[0] == PolarDataCodes.get_meas_code("ECG"):
-        ECG_parse_msg(data)
-    elif data[0] == PolarDataCodes.get_meas_code("ACC"):
-        ACC_parse_msg(data)
-    elif data[0] == PolarDataCodes.get_meas_code("PPG"):
-        PPG_parse_msg(data)
-    elif data[0] == PolarDataCodes.get_meas_code("PPI"):
-        PPI_parse_msg(data)
-    elif data[0] == PolarDataCodes.get_meas_code("GYR"):
-        GYR_parse_msg(data)
-    elif data[0] == PolarDataCodes.get_meas_code("MAG"):
-        MAG_parse_msg(data)
+## Runs on the event loop: only hands the raw frame over to the ingest pipeline (or the raw frame log)
+def data_stream_read(session, sender, data: bytes) -> None:
+    arrival = time.perf_counter_ns()
+    if debug_output:
+        print(f"[{datetime.now().isoformat()}] Data packet length: {len(data)}")
+    if session.raw_frame_log is not None:
+        session.raw_frame_log.append(data)
+    else:
+        session.pipeline.submit(session, data, arrival)
+    duration = time.perf_counter_ns() - arrival
+    session.metrics.on_callback(duration)
+    if profiler is not None:
+        profiler.record("receive", duration)
     return
 
 ## Reader/Parser function for control message data stream. 
-def ctrl_msg_reader(sender, data: bytes) -> None:
+def ctrl_msg_reader(session, sender, data: bytes) -> None:
     if data[0] == 0xf0:
-        print (f"""[{datetime.now().isoformat()}] CONTROL POINT MESSAGE: (Packet length {len(data)})
+        print (f"""[{datetime.now().isoformat()}] CONTROL POINT MESSAGE: {session.addr} (Packet length {len(data)})
 Operation:        {PolarDataCodes.op_code_dict[data[1]]} ({hex(data[1])})
 Measurement type: {PolarDataCodes.get_meas_type(data[2])} ({hex(data[2])})
 Error code:       {PolarDataCodes.error_dict[data[3]]} ({hex(data[3])})\n""")
         if data[3] == 5: #invalid parameter
-            global ctrl_stopp
-            ctrl_stopp = True
+            session.stop_requested = True
+        response = session.control_responses.pop((data[1], data[2]), None)
+        if response is not None and not response.done():
+            response.set_result(bytes(data))
     return
 
-ECG_file_header_trigger = True        
-ECG_sample_cntr = 0
-def write_ECG_file(f: TextIOBase) -> None:
-    global ECG_data_matrix, ECG_sample_cntr, ECG_file_header_trigger
-    if ECG_file_header_trigger:
-        f.write(f"\"Sample count\",\"Voltage [µV]\",\"Sensor timestamp [raw]\",\"Sensor timestamp [parsed, ISO]\"\n")
-        ECG_file_header_trigger = False
-    while len(ECG_data_matrix) > 0:
-        f.write(f"\"{ECG_sample_cntr}\",\"{ECG_data_matrix[0][0]}\",\"{ECG_data_matrix[0][2]}\",\"{ECG_data_matrix[0][1].isoformat()}\"\n")
-        ECG_sample_cntr += 1
-        ECG_data_matrix.pop(0) 
-    return
+## Vectorized conversion of raw sensor timestamps to ISO-8601 strings (UTC)
+def format_timestamps_iso(timestamps: np.ndarray) -> np.ndarray:
+    return np.char.add(np.datetime_as_string(to_datetime64(timestamps), unit="us"), "+00:00")
 
-PPG_file_header_trigger = True
-PPG_sample_cntr = 0
-def write_PPG_file(f: TextIOBase) -> None:
-    global PPG_data_matrix, PPG_sample_cntr, PPG_file_header_trigger
-    while len(PPG_data_matrix) > 0:
-        f.write(f"\n")
-        PPG_sample_cntr += 1
-        PPG_data_matrix.pop(0) 
-    return
+## The ISO-8601 column of the CSV output is only produced on request, --iso-timestamps.
+## In memory and in the binary format timestamps are always raw int64 nanoseconds since 2000.
+iso_timestamps = False
 
-ACC_file_header_trigger = True
-ACC_sample_cntr = 0
-def write_ACC_file(f: TextIOBase) -> None:
-    global ACC_data_matrix, ACC_sample_cntr, ACC_file_header_trigger
-    while len(ACC_data_matrix) > 0:
-        f.write(f"\n")
-        ACC_sample_cntr += 1
-        ACC_data_matrix.pop(0) 
-    return
+def iso_header(name: str = "Sensor timestamp [parsed, ISO]") -> str:
+    return f",\"{name}\"" if iso_timestamps else ""
 
-PPI_file_header_trigger = True
-PPI_sample_cntr = 0
-def write_PPI_file(f: TextIOBase) -> None:
-    global PPI_data_matrix, PPI_sample_cntr, PPI_file_header_trigger
-    if PPI_file_header_trigger: 
-        f.write(f"\"Sample count\",\"Heart rate [BPM]\",\"Peak-to-Peak [ms]\",\"Error estimate\",\"Invalid measurement\",\"Skin contact\",\"Skin contact status reporting supported\",\"Sensor timestamp [raw]\",\"Sensor timestamt [parsed, ISO]\"\n")
-        PPI_file_header_trigger = False
-    while len(PPI_data_matrix) > 0:
-        f.write(f"\"{PPI_sample_cntr}\",\"{PPI_data_matrix[0][0]}\",\"{PPI_data_matrix[0][1]}\",\"{PPI_data_matrix[0][2]}\",\"{PPI_data_matrix[0][3]}\",\"{PPI_data_matrix[0][4]}\",\"{PPI_data_matrix[0][5]}\",\"{PPI_data_matrix[0][6]}\",\"{PPI_data_matrix[0][7]}\"\n")
-        PPI_sample_cntr += 1
-        PPI_data_matrix.pop(0) 
-    return
+## Raw timestamp column (and the ISO column if enabled) of a block, with their row format
+def timestamp_columns(timestamps: np.ndarray) -> tuple:
+    if iso_timestamps:
+        return "\"%d\",\"%s\"\n", (timestamps, format_timestamps_iso(timestamps))
+    return "\"%d\"\n", (timestamps,)
 
-GYR_file_header_trigger = True
-GYR_sample_cntr = 0
-def write_GYR_file(f: TextIOBase) -> None:
-    global GYR_data_matrix, GYR_sample_cntr, GYR_file_header_trigger
-    while len(GYR_data_matrix) > 0:
-        f.write(f"\n")
-        GYR_sample_cntr += 1
-        GYR_data_matrix.pop(0) 
-    return
+## Formats a whole block of rows with a single string operation. Columns are equally long sequences.
+def format_csv_block(row_format: str, columns: tuple) -> str:
+    rows = len(columns[0])
+    if rows == 0:
+        return ""
+    return (row_format * rows) % tuple(chain.from_iterable(zip(*(column.tolist() for column in columns))))
 
-MAG_file_header_trigger = True
-MAG_sample_cntr = 0
-def write_MAG_file(f: TextIOBase) -> None:
-    global MAG_data_matrix, MAG_sample_cntr, MAG_file_header_trigger
-    while len(MAG_data_matrix) > 0:
-        f.write(f"\n")
-        MAG_sample_cntr += 1
-        MAG_data_matrix.pop(0) 
-    return
+## Rows of a multi channel block (channel columns..., raw timestamps): sample count, channel values, raw (and ISO) timestamp
+def format_channel_rows(first_sample: int, block: tuple) -> str:
+    *channels, timestamps = block
+    count = np.arange(first_sample, first_sample + len(timestamps))
+    timestamp_format, timestamp_values = timestamp_columns(timestamps)
+    row_format = "\"%d\"," * (len(channels) + 1) + timestamp_format
+    return format_csv_block(row_format, (count, *channels, *timestamp_values))
+
+def write_ECG_file(f: TextIOBase, stream: SensorStream, block: tuple) -> int:
+    written = 0
+    if stream.file_header_trigger:
+        written += f.write(f"\"Sample count\",\"Voltage [µV]\",\"Sensor timestamp [raw]\"{iso_header()}\n")
+        stream.file_header_trigger = False
+    if block is None:
+        return written
+    values, timestamps = block
+    count = np.arange(stream.sample_cntr, stream.sample_cntr + len(values))
+    timestamp_format, timestamp_values = timestamp_columns(timestamps)
+    written += f.write(format_csv_block("\"%d\",\"%d\"," + timestamp_format, (count, values, *timestamp_values)))
+    stream.sample_cntr += len(values)
+    return written
+
+def write_PPG_file(f: TextIOBase, stream: SensorStream, block: tuple) -> int:
+    written = 0
+    if stream.file_header_trigger:
+        written += f.write(f"\"Sample count\",\"PPG0\",\"PPG1\",\"PPG2\",\"Ambient\",\"Sensor timestamp [raw]\"{iso_header()}\n")
+        stream.file_header_trigger = False
+    if block is None:
+        return written
+    written += f.write(format_channel_rows(stream.sample_cntr, block))
+    stream.sample_cntr += len(block[-1])
+    return written
+
+def write_ACC_file(f: TextIOBase, stream: SensorStream, block: tuple) -> int:
+    written = 0
+    if stream.file_header_trigger:
+        written += f.write(f"\"Sample count\",\"X [mG]\",\"Y [mG]\",\"Z [mG]\",\"Sensor timestamp [raw]\"{iso_header()}\n")
+        stream.file_header_trigger = False
+    if block is None:
+        return written
+    written += f.write(format_channel_rows(stream.sample_cntr, block))
+    stream.sample_cntr += len(block[-1])
+    return written
+
+def write_PPI_file(f: TextIOBase, stream: SensorStream, block: tuple) -> int:
+    written = 0
+    if stream.file_header_trigger: 
+        written += f.write(f"\"Sample count\",\"Heart rate [BPM]\",\"Peak-to-Peak [ms]\",\"Error estimate\",\"Invalid measurement\",\"Skin contact\",\"Skin contact status reporting supported\",\"Sensor timestamp [raw]\"{iso_header('Sensor timestamt [parsed, ISO]')}\n")
+        stream.file_header_trigger = False
+    if block is None:
+        return written
+    timestamps = block[-1]
+    count = np.arange(stream.sample_cntr, stream.sample_cntr + len(timestamps))
+    timestamp_format, timestamp_values = timestamp_columns(timestamps)
+    written += f.write(format_csv_block("\"%d\",\"%d\",\"%d\",\"%d\",\"%s\",\"%s\",\"%s\"," + timestamp_format, (count, *block[:-1], *timestamp_values)))
+    stream.sample_cntr += len(timestamps)
+    return written
+
+def write_GYR_file(f: TextIOBase, stream: SensorStream, block: tuple) -> int:
+    written = 0
+    if stream.file_header_trigger:
+        written += f.write(f"\"Sample count\",\"X [raw]\",\"Y [raw]\",\"Z [raw]\",\"Sensor timestamp [raw]\"{iso_header()}\n")
+        stream.file_header_trigger = False
+    if block is None:
+        return written
+    written += f.write(format_channel_rows(stream.sample_cntr, block))
+    stream.sample_cntr += len(block[-1])
+    return written
+
+def write_MAG_file(f: TextIOBase, stream: SensorStream, block: tuple) -> int:
+    written = 0
+    if stream.file_header_trigger:
+        written += f.write(f"\"Sample count\",\"X [raw]\",\"Y [raw]\",\"Z [raw]\",\"Sensor timestamp [raw]\"{iso_header()}\n")
+        stream.file_header_trigger = False
+    if block is None:
+        return written
+    written += f.write(format_channel_rows(stream.sample_cntr, block))
+    stream.sample_cntr += len(block[-1])
+    return written
+
+## Derived from the ECG by RPeakDetector (--HR), next to the PPI reported by the sensor
+def write_HR_file(f: TextIOBase, stream: SensorStream, block: tuple) -> int:
+    written = 0
+    if stream.file_header_trigger:
+        written += f.write(f"\"Sample count\",\"RR interval [ms]\",\"Heart rate [BPM]\",\"Sensor timestamp [raw]\"{iso_header()}\n")
+        stream.file_header_trigger = False
+    if block is None:
+        return written
+    written += f.write(format_channel_rows(stream.sample_cntr, block))
+    stream.sample_cntr += len(block[-1])
+    return written
+
+## Column layout of each sample buffer in the binary output format
+ECG_binary_columns = (("voltage", VALUE_DTYPE), ("timestamp", TIMESTAMP_DTYPE))
+PPG_binary_columns = (("ppg0", VALUE_DTYPE), ("ppg1", VALUE_DTYPE), ("ppg2", VALUE_DTYPE), ("ambient", VALUE_DTYPE), ("timestamp", TIMESTAMP_DTYPE))
+ACC_binary_columns = (("x", VALUE_DTYPE), ("y", VALUE_DTYPE), ("z", VALUE_DTYPE), ("timestamp", TIMESTAMP_DTYPE))
+PPI_binary_columns = (("bpm", VALUE_DTYPE), ("peak_interval", VALUE_DTYPE), ("error_estimate", VALUE_DTYPE), ("invalid", VALUE_DTYPE), ("skin_contact", VALUE_DTYPE), ("skin_contact_supported", VALUE_DTYPE), ("timestamp", TIMESTAMP_DTYPE))
+GYR_binary_columns = (("x", VALUE_DTYPE), ("y", VALUE_DTYPE), ("z", VALUE_DTYPE), ("timestamp", TIMESTAMP_DTYPE))
+MAG_binary_columns = (("x", VALUE_DTYPE), ("y", VALUE_DTYPE), ("z", VALUE_DTYPE), ("timestamp", TIMESTAMP_DTYPE))
+HR_binary_columns = (("rr_interval", VALUE_DTYPE), ("heart_rate", VALUE_DTYPE), ("timestamp", TIMESTAMP_DTYPE))
+
+def write_binary_file(writer: BinaryStreamWriter, stream: SensorStream, block: tuple) -> int:
+    if block is None:
+        return 0
+    return writer.write(block)
+
+## Output format selected with --format=(csv|bin)
+output_format = "csv"
+output_formats = ("csv", "bin")
+
+## Compression of the CSV output, --compress=(gzip|zstd|lz4)[:level] (see compression.py)
+compress_codec = None
+compress_level = None
+
+## Per measurement type: CSV writer and binary column layout
+stream_outputs = {
+    "ECG": (write_ECG_file, ECG_binary_columns),
+    "PPG": (write_PPG_file, PPG_binary_columns),
+    "ACC": (write_ACC_file, ACC_binary_columns),
+    "PPI": (write_PPI_file, PPI_binary_columns),
+    "GYR": (write_GYR_file, GYR_binary_columns),
+    "MAG": (write_MAG_file, MAG_binary_columns),
+    "HR":  (write_HR_file, HR_binary_columns),
+}
+
+## Codes of the streams derived on the host (not sent by the sensor), for the binary and live feed headers
+derived_stream_codes = {
+    "HR": 0x80,
+}
+
+def stream_code(measurement_type: str) -> int:
+    if measurement_type in derived_stream_codes:
+        return derived_stream_codes[measurement_type]
+    return PolarDataCodes.get_meas_code(measurement_type)
+
+## Opens the output file(s) of one stream in the selected format.
+## Returns the file object (to be closed at the end of the segment) and the function writing a drained block to it.
+def open_stream_output(file_base_name: str, stream: SensorStream) -> tuple:
+    settings = stream.settings
+    write_csv, binary_columns = stream_outputs[settings.measurement_type]
+    if output_format == "bin":
+        f = BinaryStreamWriter(file_base_name, stream_code(settings.measurement_type), settings, binary_columns, opener=ChecksumFile)
+        return f, partial(write_binary_file, f, stream)
+    if compress_codec is not None:
+        path = f"{file_base_name}.{settings.measurement_type}.csv{compression.codec_suffixes[compress_codec]}"
+        f = CompressedFile(path, compress_codec, compress_level, f=ChecksumFile(path))
+        return f, partial(write_csv, f, stream)
+    f = ChecksumFile(f"{file_base_name}.{settings.measurement_type}.csv")
+    return f, partial(write_csv, f, stream)
+
+def output_file_names(f) -> list:
+    if isinstance(f, BinaryStreamWriter):
+        return [column.name for column in f.files]
+    return [f.name]
+
+## ChecksumFile.info() (name, size, SHA-256) of the file(s) of a closed output
+def output_file_info(f) -> list:
+    if isinstance(f, BinaryStreamWriter):
+        return [column.info() for column in f.files]
+    if isinstance(f, CompressedFile):
+        return [f.f.info()]
+    return [f.info()]
+
+def sync_output(f) -> None:
+    if isinstance(f, BinaryStreamWriter):
+        f.sync()
+    else:
+        f.flush()
+        os.fsync(f.fileno())
+
+## Segmented output: --segment=<seconds> (segments aligned to sensor time) and/or --segment-size=<MB>
+## fsync policy, --fsync=never (left to the OS), segment (when a segment is closed) or flush (every flush)
+segment_seconds = None
+segment_bytes = None
+fsync_policy = "never"
+fsync_policies = ("never", "segment", "flush")
+
+class StreamOutput:
+    # Output of one stream. Without segmentation this is the single file (set) {base}.{MEAS}.*; with it every
+    # segment is a complete file (set) of its own, with header, named {base}.{index:04d}.{MEAS}.*. Segments are
+    # listed in the session manifest with their first and last sensor timestamp. CSV files get a sparse time
+    # index (see timeindex.py) with one entry per written block.
+    def __init__(self, file_base_name: str, stream: SensorStream, manifest: OutputManifest) -> None:
+        self.file_base_name = file_base_name
+        self.stream = stream
+        self.manifest = manifest
+        self.segmented = segment_seconds is not None or segment_bytes is not None
+        self.segment_ns = None if segment_seconds is None else int(segment_seconds * 1e9)
+        self.index = -1
+        self.open_segment()
+
+    def open_segment(self) -> None:
+        self.index += 1
+        base = f"{self.file_base_name}.{self.index:04d}" if self.segmented else self.file_base_name
+        self.stream.file_header_trigger = True
+        self.file, self.write = open_stream_output(base, self.stream)
+        files = output_file_names(self.file)
+        self.time_index = None
+        if not isinstance(self.file, BinaryStreamWriter):
+            self.time_index = TimeIndexWriter(index_path(self.file.name))
+            files.append(self.time_index.path)
+        self.slot = None # time slot (sensor time // segment length) of the samples in the segment
+        self.segment = self.manifest.add_segment(self.stream.settings.measurement_type, self.index, files)
+
+    def close_segment(self) -> None:
+        if fsync_policy != "never":
+            sync_output(self.file)
+        self.file.close()
+        files = output_file_info(self.file)
+        if self.time_index is not None:
+            if fsync_policy != "never":
+                self.time_index.sync()
+            self.time_index.close()
+            files.append(self.time_index.f.info())
+        self.count_written(0)
+        self.segment["closed"] = True
+        self.manifest.add_closed_files(self.stream.settings.measurement_type, files, self.segment["first_timestamp"], self.segment["last_timestamp"])
+        self.manifest.save()
+
+    def split(self, block: tuple) -> list:
+        # Cuts a block at the segment time boundaries (timestamps are the last column)
+        if self.segment_ns is None:
+            return [block]
+        slots = block[-1] // self.segment_ns
+        cuts = (np.flatnonzero(np.diff(slots)) + 1).tolist()
+        if len(cuts) == 0:
+            return [block]
+        return [tuple(column[start:end] for column in block) for start, end in zip([0] + cuts, cuts + [len(slots)])]
+
+    def write_block(self, block: tuple) -> int:
+        timestamps = block[-1]
+        slot = None if self.segment_ns is None else int(timestamps[0] // self.segment_ns)
+        segment = self.segment
+        if segment["samples"] > 0 and (slot != self.slot or (segment_bytes is not None and segment["bytes"] >= segment_bytes)):
+            self.close_segment()
+            self.open_segment()
+            segment = self.segment
+        self.slot = slot
+        if self.time_index is None:
+            written = self.write(block)
+        elif isinstance(self.file, CompressedFile):
+            # header and block are frames of their own, the index points at the (compressed) block frame
+            written = self.write(None) if self.stream.file_header_trigger else 0
+            self.file.end_frame()
+            written += self.write(block)
+            self.file.end_frame(partial(self.time_index.append, int(timestamps[0]), int(timestamps[-1]), samples=len(timestamps)))
+        else:
+            written = self.write(None) if self.stream.file_header_trigger else 0 # header is not part of the indexed rows
+            offset = self.file.tell()
+            written += self.write(block)
+            self.time_index.append(int(timestamps[0]), int(timestamps[-1]), offset, self.file.tell() - offset, len(timestamps))
+        if segment["first_timestamp"] is None:
+            segment["first_timestamp"] = int(timestamps[0])
+        segment["last_timestamp"] = int(timestamps[-1])
+        segment["samples"] += len(timestamps)
+        self.count_written(written)
+        return written
+
+    def count_written(self, written: int) -> None:
+        # Segment size on disk, checked against --segment-size: compressed files count the compressed frames
+        # written so far (frames still being compressed are added once they are in the file)
+        if isinstance(self.file, CompressedFile):
+            self.segment["bytes"] = self.file.position
+        else:
+            self.segment["bytes"] += written
+
+    def flush(self) -> int:
+        # Writes everything buffered so far; returns the number of bytes written
+        block = self.stream.buffer.drain()
+        if block is not None and self.stream.summary is not None:
+            self.stream.summary.add(block)
+            self.stream.summary.flush()
+        if block is None:
+            written = self.write(None)
+            self.count_written(written)
+        else:
+            written = sum(self.write_block(part) for part in self.split(block))
+        # handed to the OS every flush: readable by read_window while recording, at most one flush lost on a crash
+        if isinstance(self.file, CompressedFile):
+            self.file.end_frame()
+            self.file.f.flush() # the frames compressed so far, without waiting for the others
+            self.count_written(0)
+        else:
+            self.file.flush()
+        if self.time_index is not None:
+            self.time_index.flush()
+        if fsync_policy == "flush":
+            sync_output(self.file)
+            if self.time_index is not None:
+                self.time_index.sync()
+        return written
+
+    def close(self) -> None:
+        self.close_segment()
+
+
+## Min/max/mean summary tiers of every stream, --summary[=window,...] in seconds (see summary.py)
+summary_windows = None
+
+## Heart rate and RR intervals derived from the ECG on the host, --HR (see ecgdsp.py)
+derive_heart_rate = False
+
+class SensorSession:
+    # Everything belonging to one connected sensor: its streams (settings, buffers, counters, files), the streams
+    # derived from them, the ingest pipeline its frames are decoded by and, in --raw mode, the raw frame log.
+    def __init__(self, addr: str, settings: list, file_base_name: str, pipeline: "IngestPipeline" = None) -> None:
+        self.addr = addr
+        self.file_base_name = file_base_name
+        self.streams = {s.measurement_type: SensorStream(s) for s in settings}
+        self.streams_by_code = {PolarDataCodes.get_meas_code(meas): stream for meas, stream in self.streams.items()}
+        self.decoders = build_decoders(self.streams)
+        self.derived_streams = {}
+        self.heart_rate_detector = None
+        if derive_heart_rate and "ECG" in self.streams:
+            ecg = self.streams["ECG"].settings
+            self.derived_streams["HR"] = SensorStream(PolarDataStreamSettings("HR", ecg.sample_freq, 0))
+            self.heart_rate_detector = RPeakDetector(ecg.sample_freq)
+        self.metrics = DeviceMetrics()
+        self.pipeline = pipeline
+        self.raw_frame_log = None
+        self.manifest = None
+        self.stop_requested = False
+        self.control_responses = {} # (op code, measurement code) -> future of the control point response
+        self.connections = 0 # connections that got as far as starting the streams
+        self.link_lost = False
+        self.received_frames = 0
+        self.dropped_frames = 0
+        self.failed_flushes = 0
+
+    def open_outputs(self) -> None:
+        output = {"format": output_format, "compression": compress_codec, "segment_seconds": segment_seconds, "segment_bytes": segment_bytes}
+        self.manifest = OutputManifest(manifest_path(self.file_base_name), self.addr, [stream.settings for stream in self.output_streams()], output)
+        for stream in self.output_streams():
+            stream.output = StreamOutput(self.file_base_name, stream, self.manifest)
+            if summary_windows is not None:
+                meas = stream.settings.measurement_type
+                stream.summary = StreamSummary(self.file_base_name, meas, [name for name, _ in stream_outputs[meas][1][:-1]], summary_windows)
+                self.manifest.add_open_files(stream.summary.paths())
+
+    def output_streams(self):
+        return chain(self.streams.values(), self.derived_streams.values())
+
+    def open_live_feeds(self) -> None:
+        for stream in self.output_streams():
+            meas = stream.settings.measurement_type
+            capacity = max(1024, int(live_seconds * stream.settings.sample_freq))
+            stream.live = LiveFeedWriter(live_feed_name(self.addr, meas), stream_code(meas), stream.settings.sample_freq, stream_outputs[meas][1], capacity)
+
+    def flush(self) -> None:
+        for stream in self.output_streams():
+            if stream.output is not None:
+                stream.metrics.bytes_flushed += stream.output.flush()
+
+    def derive(self, measurement_type: str, block: tuple) -> None:
+        # Feeds a decoded block of a sensor stream to the online processing deriving other streams from it
+        if measurement_type == "ECG" and self.heart_rate_detector is not None:
+            derived = self.heart_rate_detector.process(*block)
+            if len(derived[-1]) > 0:
+                stream = self.derived_streams["HR"]
+                stream.buffer.append(*derived)
+                if stream.live is not None:
+                    stream.live.publish(derived)
 
-## Aynchronous task to start the data stream for ECG ##
-async def run(client: BleakClient, addr: str, debug: bool = False) -> None:
+    def decode(self, data: bytes, arrival: int) -> None:
+        stream = self.streams_by_code.get(data[0])
+        if stream is None:
+            return # not a recorded stream
+        last_timestamp = stream.metrics.last_timestamp
+        start = time.perf_counter_ns()
+        stream, block = parse_frame(data, self.decoders)
+        parse_ns = time.perf_counter_ns() - start
+        if profiler is not None:
+            profiler.record("parse", parse_ns)
+        _, timestamp, _ = FRAME_HEADER.unpack_from(data)
+        stream.metrics.on_frame(arrival, timestamp, len(block[-1]), parse_ns)
+        if len(block[-1]) > 0:
+            if stream.resumed:
+                stream.resumed = False
+                self.record_gap(stream, last_timestamp, timestamp, block)
+            if stream.live is not None:
+                stream.live.publish(block)
+            self.derive(stream.settings.measurement_type, block)
+
+    def resume(self) -> None:
+        # The link was re-established: frames decoded from now on come from the restarted measurements
+        for stream in self.streams.values():
+            stream.resumed = True
+
+    def record_gap(self, stream: SensorStream, last_timestamp: int, timestamp: int, block: tuple) -> None:
+        # Gap marker between the last sample before the link was lost and the first one after the reconnect.
+        # The sensor timestamps of the two frames (time of their last sample) give the number of samples missed.
+        meas = stream.settings.measurement_type
+        first_timestamp = int(block[-1][0])
+        missing = None
+        if last_timestamp is not None and stream.metrics.sample_period_ns:
+            missing = max(0, round((timestamp - last_timestamp) / stream.metrics.sample_period_ns) - len(block[-1]))
+        if self.manifest is not None:
+            self.manifest.add_gap(meas, last_timestamp, first_timestamp, missing)
+        duration = "of unknown length" if last_timestamp is None else f"of {(first_timestamp - last_timestamp) / 1e9:.3f} s"
+        print(f"{self.addr}: {meas} resumed after a gap {duration}" + ("" if missing is None else f", {missing} sample(s) missing"))
+        if meas == "ECG" and self.heart_rate_detector is not None:
+            # no RR interval across the gap: the detector starts over
+            self.heart_rate_detector = RPeakDetector(stream.settings.sample_freq)
+
+    def close_outputs(self) -> None:
+        for stream in self.output_streams():
+            if stream.output is not None:
+                stream.output.close()
+                stream.output = None
+            if stream.summary is not None:
+                files = stream.summary.close()
+                self.manifest.add_closed_files(stream.settings.measurement_type, files, stream.summary.first_timestamp, stream.summary.last_timestamp)
+                self.manifest.save()
+                stream.summary = None
+            if stream.live is not None:
+                stream.live.close()
+                stream.live = None
+
+class IngestPipeline:
+    # Bounded hand-over of raw PMD frames from the BLE callbacks of all sessions to one writer thread.
+    # The writer thread decodes the frames and flushes the sample buffers of the attached sessions every
+    # flush_interval seconds. When the queue is full new frames are dropped (never blocking the event loop) and counted.
+    def __init__(self, max_frames: int = 4096, flush_interval: float = 1.0) -> None:
+        self.frames = queue.Queue(maxsize=max_frames)
+        self.flush_interval = flush_interval
+        self.sessions = []
+        self.received_frames = 0
+        self.dropped_frames = 0
+        self.overflow_events = 0
+        self.failed_frames = 0
+        self.failed_flushes = 0
+        self.peak_depth = 0
+        self.overflowing = False
+        self.stopping = threading.Event()
+        self.thread = threading.Thread(target=self.worker, name="ingest-writer", daemon=True)
+
+    def submit(self, session: SensorSession, data: bytes, arrival: int) -> bool:
+        self.received_frames += 1
+        session.received_frames += 1
+        try:
+            self.frames.put_nowait((session, data, arrival))
+        except queue.Full:
+            self.dropped_frames += 1
+            session.dropped_frames += 1
+            if not self.overflowing:
+                self.overflowing = True
+                self.overflow_events += 1
+            return False
+        self.overflowing = False
+        depth = self.frames.qsize()
+        if depth > self.peak_depth:
+            self.peak_depth = depth
+        return True
+
+    def start(self) -> None:
+        self.thread.start()
+
+    def stop(self) -> None:
+        self.stopping.set()
+        if self.thread.is_alive():
+            self.thread.join()
+
+    def attach(self, session: SensorSession) -> None:
+        # session outputs are open: flush them from now on
+        self.sessions.append(session)
+
+    def running(self) -> bool:
+        return self.thread.is_alive()
+
+    def put_marker(self, item: tuple) -> None:
+        # Markers are never dropped: waits for room in the queue, as long as the writer thread is there to make it
+        while True:
+            if not self.running():
+                raise RuntimeError("the ingest writer thread is not running")
+            try:
+                self.frames.put(item, timeout=0.5)
+                return
+            except queue.Full:
+                pass
+
+    async def resume(self, session: SensorSession) -> None:
+        # Queues a marker behind the frames received before the link was lost: frames after it are the
+        # first ones of the restarted measurements (see SensorSession.resume)
+        await asyncio.get_running_loop().run_in_executor(None, self.put_marker, (session, None, None))
+
+    async def detach(self, session: SensorSession) -> None:
+        # Queues a marker behind the last frame of the session; the writer thread flushes and closes the
+        # session outputs when it gets there. Waits without blocking the event loop.
+        done = Future()
+        await asyncio.get_running_loop().run_in_executor(None, self.put_marker, (session, done, None))
+        closed = asyncio.wrap_future(done)
+        while not closed.done():
+            if not self.running():
+                raise RuntimeError("the ingest writer thread is not running")
+            await asyncio.wait([closed], timeout=0.5)
+        closed.result()
+
+    def decode_pending(self, deadline: float) -> None:
+        try:
+            session, data, arrival = self.frames.get(timeout=max(0.0, deadline - time.monotonic()))
+        except queue.Empty:
+            return
+        while True:
+            if isinstance(data, Future):
+                self.close_session(session, data)
+            elif data is None:
+                session.resume()
+            else:
+                try:
+                    session.decode(data, arrival)
+                except Exception as ex:
+                    # counted in the summary and the metrics, printed one by one only with --debug
+                    self.failed_frames += 1
+                    if debug_output:
+                        print(f"Failed to decode frame from {session.addr}: {ex}")
+            if time.monotonic() >= deadline:
+                return
+            try:
+                session, data, arrival = self.frames.get_nowait()
+            except queue.Empty:
+                return
+
+    def flush_failed(self, session: SensorSession, ex: Exception) -> None:
+        # Write errors (e.g. a full disk) are counted like failed frames; the first one of a session is always printed
+        self.failed_flushes += 1
+        session.failed_flushes += 1
+        if session.failed_flushes == 1 or debug_output:
+            print(f"ERROR: {session.addr}: writing the output failed: {ex!r}")
+
+    def close_session(self, session: SensorSession, done: Future) -> None:
+        try:
+            try:
+                session.flush()
+            except Exception as ex:
+                self.flush_failed(session, ex)
+            try:
+                session.close_outputs()
+            except Exception as ex:
+                self.flush_failed(session, ex)
+        finally:
+            if session in self.sessions:
+                self.sessions.remove(session)
+            done.set_result(None)
+
+    def flush(self) -> None:
+        for session in tuple(self.sessions):
+            start = time.perf_counter_ns()
+            try:
+                session.flush()
+            except Exception as ex:
+                self.flush_failed(session, ex)
+            if profiler is not None:
+                profiler.record("flush", time.perf_counter_ns() - start)
+
+    def worker(self) -> None:
+        next_flush = time.monotonic() + self.flush_interval
+        while not self.stopping.is_set():
+            self.decode_pending(next_flush)
+            if time.monotonic() >= next_flush:
+                self.flush()
+                next_flush = max(next_flush + self.flush_interval, time.monotonic())
+        # final drain of everything received before stop
+        while not self.frames.empty():
+            self.decode_pending(float("inf"))
+        self.flush()
+
+    def stats(self) -> str:
+        return f"frames received: {self.received_frames}, dropped: {self.dropped_frames} (overflow events: {self.overflow_events}), failed: {self.failed_frames}, failed flushes: {self.failed_flushes}, peak queue depth: {self.peak_depth}/{self.frames.maxsize}"
+
+## Raw PMD frame log capture mode, --raw (see rawlog.py)
+raw_capture = False
+
+## Cache of the sensors' PMD features and supported settings, --cache-dir=<directory> (see settingscache.py)
+settings_cache_dir = os.path.join(os.path.expanduser("~"), ".cache", "sense")
+
+## Shared memory live feed of the decoded samples, --live[=seconds of samples held] (see livefeed.py)
+live_seconds = None
+
+def settings_from_description(streams: dict) -> list:
+    return [PolarDataStreamSettings(meas, s["sample_freq"], s["resolution"], s["range"]) for meas, s in streams.items()]
+
+## Worker process: decodes the frames of one chunk and returns the drained sample buffers per measurement type
+def decode_raw_log_chunk(path: str, start: int, end: int, streams: dict) -> tuple:
+    streams = {s.measurement_type: SensorStream(s) for s in settings_from_description(streams)}
+    decoders = build_decoders(streams)
+    with open(path, "rb") as f:
+        f.seek(start)
+        data = f.read(end - start)
+    failed = 0
+    for _, frame in iter_raw_log_records(data):
+        try:
+            parse_frame(frame, decoders)
+        except Exception:
+            failed += 1
+    return {meas: stream.buffer.drain() for meas, stream in streams.items()}, failed
+
+def decode_raw_log(path: str, jobs: int = None, chunk_size: int = 1 << 22) -> None:
+    description, chunks = split_raw_log(path, chunk_size)
+    streams = description["streams"]
+    file_base_name = path[:-len(".pmd")] if path.endswith(".pmd") else path
+    print(f"Decoding {path}: {len(chunks)} chunk(s), streams: {', '.join(streams)}")
+
+    # the manifest of the capture is replaced by the one of the decoded output, which keeps listing the raw log
+    try:
+        raw_log_files = [f for f in read_manifest(manifest_path(file_base_name))["files"] if f["name"] == os.path.basename(path)]
+    except (OSError, ValueError, KeyError):
+        raw_log_files = []
+
+    session = SensorSession(description["address"], settings_from_description(streams), file_base_name)
+    session.open_outputs()
+    session.manifest.files += raw_log_files
+
+    def write_chunk(result: tuple) -> int:
+        blocks, chunk_failed = result
+        for meas, block in blocks.items():
+            if block is not None:
+                session.streams[meas].buffer.append(*block)
+                session.derive(meas, block)
+        session.flush()
+        return chunk_failed
+
+    # Bounded window of chunks in flight; results are written in log order
+    jobs = jobs or os.cpu_count() or 1
+    failed = 0
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        pending = deque()
+        for start, end in chunks:
+            pending.append(executor.submit(decode_raw_log_chunk, path, start, end, streams))
+            if len(pending) >= 2 * jobs:
+                failed += write_chunk(pending.popleft().result())
+        while pending:
+            failed += write_chunk(pending.popleft().result())
+
+    session.close_outputs()
+    print(f"Decoded {len(chunks)} chunk(s), {failed} frame(s) could not be decoded")
+
+## Writes a control point request and waits for its response (None if the sensor does not answer in time)
+CONTROL_RESPONSE_TIMEOUT = 5.0
+
+async def control_request(client: BleakClient, session: SensorSession, command: bytearray, timeout: float = CONTROL_RESPONSE_TIMEOUT) -> bytes:
+    key = (command[0], command[1])
+    response = asyncio.get_running_loop().create_future()
+    session.control_responses[key] = response
+    try:
+        await client.write_gatt_char(PMD_CONTROL, command)
+        return await asyncio.wait_for(response, timeout)
+    except asyncio.TimeoutError:
+        print(f"WARNING: {session.addr}: no control point response to {command.hex()} within {timeout:g} s")
+        return None
+    finally:
+        session.control_responses.pop(key, None)
+
+## Reconnect after a lost or failed connection: --reconnect=<N> consecutive failed attempts at most
+## (default: no limit, 0: never), waiting reconnect_backoff[0] seconds doubled after every failure up to reconnect_backoff[1]
+reconnect_attempts = None
+reconnect_backoff = (1.0, 30.0)
+
+## Disconnected callback of the BLE client
+def link_lost(session: SensorSession, client) -> None:
+    if not ctrl_stopp and not session.stop_requested: # not disconnected on purpose
+        session.link_lost = True
+
+## Aynchronous task to collect the data streams of one sensor ##
+async def run(client: BleakClient, session: SensorSession, debug: bool = False) -> None:
 
     ## Writing chracterstic description to control point for request of UUID (defined above) ##
     await client.is_connected()
-    print("---------Device connected--------------")
-    model_number = await client.read_gatt_char(MODEL_NBR_UUID)
-    manufacturer_name = await client.read_gatt_char(MANUFACTURER_NAME_UUID)
-    battery_level = await client.read_gatt_char(BATTERY_LEVEL_UUID)
-    print(f"""Model Number: {''.join(map(chr,model_number))}
+    print(f"---------Device {session.addr} connected--------------")
+    cache = load_cache(settings_cache_dir, session.addr) if settings_cache_dir is not None else {"settings": {}}
+    cache_changed = False
+
+    async def read_features() -> bytes:
+        if "features" in cache:
+            return bytes.fromhex(cache["features"])
+        return bytes(await client.read_gatt_char(PMD_CONTROL))
+
+    ## Independent reads are issued at once; the control message reader/parser is started alongside
+    model_number, manufacturer_name, battery_level, att_read, _ = await asyncio.gather(
+        client.read_gatt_char(MODEL_NBR_UUID),
+        client.read_gatt_char(MANUFACTURER_NAME_UUID),
+        client.read_gatt_char(BATTERY_LEVEL_UUID),
+        read_features(),
+        client.start_notify(PMD_CONTROL, partial(ctrl_msg_reader, session)),
+    )
+    print(f"""Device: {session.addr}
+Model Number: {''.join(map(chr,model_number))}
 Manufacturer Name: {''.join(map(chr,manufacturer_name))}
 Battery Level: {int(battery_level[0])}%\n""")
-    
-    global ECG_data_collection_flag, ACC_data_collection_flag, PPI_data_collection_flag, PPG_data_collection_flag, GYR_data_collection_flag, MAG_data_collection_flag
-
-    ## Creating default "start data stream" command
-    if ECG_data_collection_flag:
-        stream_ecg_config = PolarDataStreamSettings("ECG", SAMPLING_FREQ_ECG, 14)
-        pass
-    if ACC_data_collection_flag:
-        stream_acc_config = PolarDataStreamSettings("ACC", 100)
-        pass
-    if PPG_data_collection_flag:
-        stream_ppg_config = PolarDataStreamSettings("PPG", SAMPLING_FREQ_ECG, 14)
-        pass
-    if PPI_data_collection_flag:
-        stream_ppi_config = PolarDataStreamSettings("PPI", 100)
-        pass
-    if GYR_data_collection_flag:
-        stream_gyr_config = PolarDataStreamSettings("GYR", SAMPLING_FREQ_ECG, 14)
-        pass
-    if MAG_data_collection_flag:
-        stream_mag_config = PolarDataStreamSettings("MAG", 100)
-        pass
-    
-    att_read = await client.read_gatt_char(PMD_CONTROL)
-    
-    ## Start control message reader/parser
-    #await client.write_gatt_char(PMD_CONTROL, CMD_ECG_STREAM_SETTINGS_READ)
-    await client.start_notify(PMD_CONTROL, ctrl_msg_reader)
-    await asyncio.sleep(5)
-   
+    if "features" not in cache:
+        cache["features"] = att_read.hex()
+        cache_changed = True
+
+    ## Supported settings of every requested measurement type: from the cache, or asked once from the sensor
+    for stream in session.streams.values():
+        meas = stream.settings.measurement_type
+        if meas in cache["settings"]:
+            response = bytes.fromhex(cache["settings"][meas])
+        else:
+            response = await control_request(client, session, stream.settings.cmd_settings_array())
+            if response is None or response[3] != 0:
+                continue
+            cache["settings"][meas] = response.hex()
+            cache_changed = True
+        supported = parse_settings_response(response)
+        requested = {0x00: stream.settings.sample_freq, 0x01: stream.settings.resolution}
+        for setting_type, value in requested.items():
+            if meas != "PPI" and setting_type in supported and value not in supported[setting_type]:
+                print(f"WARNING: {session.addr}: {meas} {SETTING_NAMES[setting_type]} {value} is not supported (supported: {supported[setting_type]})")
+    if cache_changed and settings_cache_dir is not None:
+        save_cache(settings_cache_dir, cache)
+
+    session.link_lost = False
+    if raw_capture and session.raw_frame_log is None:
+        settings = [stream.settings for stream in session.streams.values()]
+        session.raw_frame_log = RawFrameLog(f"{session.file_base_name}.pmd", session.addr, settings, opener=ChecksumFile)
+        session.manifest = OutputManifest(manifest_path(session.file_base_name), session.addr, settings, {"format": "raw"})
+        session.manifest.add_open_files([session.raw_frame_log.path])
+
+    ## Reconnected: frames of the restarted measurements continue the same recording, behind a gap marker
+    if session.connections > 0 and not raw_capture:
+        await session.pipeline.resume(session)
+
     ## Start data stream reader/parser
-    await client.start_notify(PMD_DATA, data_stream_read)
-
-    # Send start command(s) to sensor
-    if ECG_data_collection_flag:
-        await client.write_gatt_char(PMD_CONTROL, stream_ecg_config.cmd_start_array())
-        pass
-    if ACC_data_collection_flag:
-        await client.write_gatt_char(PMD_CONTROL, stream_acc_config.cmd_start_array())
-        pass
-    if PPI_data_collection_flag:
-        await client.write_gatt_char(PMD_CONTROL, stream_ppi_config.cmd_start_array())
-        pass
-    if PPG_data_collection_flag:
-        await client.write_gatt_char(PMD_CONTROL, stream_ppg_config.cmd_start_array())
-        pass
-    if GYR_data_collection_flag:
-        await client.write_gatt_char(PMD_CONTROL, stream_gyr_config.cmd_start_array())
-        pass
-    if MAG_data_collection_flag:
-        await client.write_gatt_char(PMD_CONTROL, stream_mag_config.cmd_start_array())
-        pass
-   
-    
-    file_base_name = f"data_{addr.replace(':','')}_{datetime.now().strftime('%Y%m%dT%H%M%S')}"
-    if ECG_data_collection_flag:
-        file_ECG =  open(f"{file_base_name}.ECG.csv","w")
-        pass
-    if ACC_data_collection_flag:
-        file_ACC =  open(f"{file_base_name}.ACC.csv","w")
-        pass
-    if PPI_data_collection_flag:
-        file_PPI =  open(f"{file_base_name}.PPI.csv","w")
-        pass
-    if PPG_data_collection_flag:
-        file_PPG =  open(f"{file_base_name}.PPG.csv","w")
-        pass
-    if GYR_data_collection_flag:
-        file_GYR =  open(f"{file_base_name}.GYR.csv","w")
-        pass
-    if MAG_data_collection_flag:
-        file_MAG =  open(f"{file_base_name}.MAG.csv","w")
-        pass
-    
+    await client.start_notify(PMD_DATA, partial(data_stream_read, session))
+
+    # Send start command(s) to sensor, each one once the previous one is acknowledged
+    for stream in session.streams.values():
+        await control_request(client, session, stream.settings.cmd_start_array())
+
+    ## Decoding and file output happens on the writer thread (outputs stay open across reconnects)
+    if not raw_capture and session.connections == 0:
+        session.open_outputs()
+        if live_seconds is not None:
+            session.open_live_feeds()
+        session.pipeline.attach(session)
+    session.connections += 1
+
     try:
         global ctrl_stopp
         if ctrl_stopp == False: 
-            print("Collecting data...")
-            while not ctrl_stopp:
-                ## Write collected data every 1 second(s)
+            print(f"Collecting data from {session.addr}...")
+            dropped_frames = 0
+            while not ctrl_stopp and not session.stop_requested and not session.link_lost:
                 await asyncio.sleep(1)
-                if ECG_data_collection_flag:
-                    write_ECG_file(file_ECG)
-                    pass
-                if PPG_data_collection_flag:
-                    write_PPG_file(file_PPG)
-                    pass
-                if ACC_data_collection_flag:
-                    write_ACC_file(file_ACC)
-                    pass
-                if PPI_data_collection_flag:
-                    write_PPI_file(file_PPI)
-                    pass
-                if GYR_data_collection_flag:
-                    write_GYR_file(file_GYR)
-                    pass
-                if MAG_data_collection_flag:
-                    write_MAG_file(file_MAG)
-                    pass
+                if session.raw_frame_log is not None:
+                    session.raw_frame_log.flush()
+                elif not session.pipeline.running():
+                    print(f"ERROR: {session.addr}: the ingest writer thread stopped, ending the recording")
+                    session.stop_requested = True
+                elif session.dropped_frames != dropped_frames:
+                    dropped_frames = session.dropped_frames
+                    print(f"WARNING: ingest queue overflow, {dropped_frames} frame(s) from {session.addr} dropped ({session.pipeline.stats()})")
     except Exception as ex:
         print(ex)
+    if session.link_lost:
+        raise ConnectionError(f"[{datetime.now().isoformat()}] connection lost")
     
     ## Stop the stream once data is collected
-    # sending stop stream command
-    if ECG_data_collection_flag:
-        await client.write_gatt_char(PMD_CONTROL, stream_ecg_config.cmd_stop_array())
-        pass
-    if ACC_data_collection_flag:
-        await client.write_gatt_char(PMD_CONTROL, stream_acc_config.cmd_stop_array())
-        pass
-    if PPI_data_collection_flag:
-        await client.write_gatt_char(PMD_CONTROL, stream_ppi_config.cmd_stop_array())
-        pass
-    if PPG_data_collection_flag:
-        await client.write_gatt_char(PMD_CONTROL, stream_ppg_config.cmd_stop_array())
-        pass
-    if GYR_data_collection_flag:
-        await client.write_gatt_char(PMD_CONTROL, stream_gyr_config.cmd_stop_array())
-        pass
-    if MAG_data_collection_flag:
-        await client.write_gatt_char(PMD_CONTROL, stream_mag_config.cmd_stop_array())
-        pass
-
-    # waiting for stop command acknowledge
-    await asyncio.sleep(2)
-
-    # writing final datapoints and closing file handles
-    if ECG_data_collection_flag:
-        write_ECG_file(file_ECG)
-        file_ECG.close() 
-        pass
-    if ACC_data_collection_flag:
-        write_ACC_file(file_ACC)
-        file_ACC.close()
-        pass
-    if PPI_data_collection_flag:
-        write_PPI_file(file_PPI)
-        file_PPI.close()
-        pass
-    if PPG_data_collection_flag:
-        write_PPG_file(file_PPG)
-        file_PPG.close()
-        pass
-    if GYR_data_collection_flag:
-        write_GYR_file(file_GYR)
-        file_GYR.close()
-        pass
-    if MAG_data_collection_flag:
-        write_MAG_file(file_MAG)
-        file_MAG.close()
-        pass
+    # sending stop stream command and waiting for its acknowledge
+    for stream in session.streams.values():
+        await control_request(client, session, stream.settings.cmd_stop_array(), timeout=2.0)
 
     ## Stopping local listening services
     await client.stop_notify(PMD_DATA)
     await client.stop_notify(PMD_CONTROL)
-    print("Stopping data collection...")
-    print("[CLOSED] application closed.")
-
-    sys.exit(0)
+    print(f"Stopping data collection from {session.addr}...")
 
 
 async def main(args: list) -> None:
-    if len(args) > 0:
-        global ECG_data_collection_flag, ACC_data_collection_flag, PPI_data_collection_flag, PPG_data_collection_flag, GYR_data_collection_flag, MAG_data_collection_flag
+    global output_format, iso_timestamps, derive_heart_rate, summary_windows, debug_output
+    debug_output = "--debug" in args
+    for arg in args:
+        if arg.startswith("--format="):
+            output_format = arg[arg.index("=") + 1:].strip().lower()
+    iso_timestamps = "--iso-timestamps" in args
+    derive_heart_rate = "--HR" in args
+    for arg in args:
+        if arg == "--summary":
+            summary_windows = (1, 10, 60)
+        elif arg.startswith("--summary="):
+            summary_windows = tuple(float(window) for window in arg[arg.index("=") + 1:].split(","))
 
-        ECG_data_collection_flag = "--ECG" in args
-        ACC_data_collection_flag = "--ACC" in args
-        PPI_data_collection_flag = "--PPI" in args
-        PPG_data_collection_flag = "--PPG" in args
-        GYR_data_collection_flag = "--GYR" in args
-        MAG_data_collection_flag = "--MAG" in args
+    global segment_seconds, segment_bytes, fsync_policy
+    for arg in args:
+        if arg.startswith("--segment="):
+            segment_seconds = float(arg[arg.index("=") + 1:])
+        elif arg.startswith("--segment-size="):
+            segment_bytes = int(float(arg[arg.index("=") + 1:]) * 1e6)
+        elif arg.startswith("--fsync="):
+            fsync_policy = arg[arg.index("=") + 1:].strip().lower()
+    global compress_codec, compress_level
+    for arg in args:
+        if arg.startswith("--compress="):
+            compress_codec, _, level = arg[arg.index("=") + 1:].strip().lower().partition(":")
+            compress_level = int(level) if level else None
+        elif arg.startswith("--compress-jobs="):
+            compression.compression_workers = int(arg[arg.index("=") + 1:])
+    if compress_codec is not None and compress_codec not in compression.available_codecs():
+        print(f"Unavailable compression codec: {compress_codec} (available: {', '.join(compression.available_codecs())})")
+        print("Exiting")
+        return
+    if compress_codec is not None and output_format == "bin":
+        print("Compression is only supported for the csv output format (binary columns are memory mapped)")
+        print("Exiting")
+        return
+
+    if fsync_policy not in fsync_policies:
+        print(f"Unknown fsync policy: {fsync_policy} (supported: {', '.join(fsync_policies)})")
+        print("Exiting")
+        return
+    if output_format not in output_formats:
+        print(f"Unknown output format: {output_format} (supported: {', '.join(output_formats)})")
+        print("Exiting")
+        return
+
+    if len(args) > 0 and args[0] == "decode":
+        jobs = None
+        for arg in args:
+            if arg.startswith("--jobs="):
+                jobs = int(arg[arg.index("=") + 1:])
+        logs = [arg for arg in args[1:] if not arg.startswith("--")]
+        if len(logs) == 0:
+            print("No raw log file provided")
+            print("Exiting")
+        for path in logs:
+            decode_raw_log(path, jobs)
+    elif len(args) > 0:
+        ## Sensor MAC addresses are all arguments that are not flags; every sensor records the same data types
+        addresses = [arg for arg in args if not arg.startswith("--")]
+        measurement_types = [meas for meas in default_stream_settings if f"--{meas}" in args]
+
+        global raw_capture, live_seconds, settings_cache_dir, reconnect_attempts
+        raw_capture = "--raw" in args
+        for arg in args:
+            if arg.startswith("--reconnect="):
+                reconnect_attempts = int(arg[arg.index("=") + 1:])
+            elif arg.startswith("--cache-dir="):
+                settings_cache_dir = arg[arg.index("=") + 1:] or None
+            elif arg == "--live":
+                live_seconds = 60.0
+            elif arg.startswith("--live="):
+                live_seconds = float(arg[arg.index("=") + 1:])
+
+        ## Simulated sensor instead of BLE hardware: --simulate[=speed] and/or --replay=<raw log>,
+        ## --simulate-drop=<s>: the simulated link is lost s seconds after every connect,
+        ## --simulate-sensors=<N>: N simulated sensors with generated addresses (no addresses needed)
+        simulate_speed = None
+        simulate_drop = None
+        replay_log = None
+        for arg in args:
+            if arg == "--simulate":
+                simulate_speed = 1.0
+            elif arg.startswith("--simulate="):
+                simulate_speed = float(arg[arg.index("=") + 1:])
+            elif arg.startswith("--simulate-drop="):
+                simulate_drop = float(arg[arg.index("=") + 1:])
+            elif arg.startswith("--simulate-sensors="):
+                addresses += simulated_addresses(int(arg[arg.index("=") + 1:]))
+                simulate_speed = simulate_speed or 1.0
+            elif arg.startswith("--replay="):
+                replay_log = arg[arg.index("=") + 1:]
+                simulate_speed = simulate_speed or 1.0
+
+        ## Profiling mode: --profile[=<JSON report>], --slow-callback=<ms> (default: 50), --profile-samples=<folded stacks file>
+        global profiler
+        profile = False
+        profile_report = None
+        profile_samples = None
+        slow_callback = 0.05
+        for arg in args:
+            if arg == "--profile":
+                profile = True
+            elif arg.startswith("--profile="):
+                profile, profile_report = True, arg[arg.index("=") + 1:]
+            elif arg.startswith("--profile-samples="):
+                profile, profile_samples = True, arg[arg.index("=") + 1:]
+            elif arg.startswith("--slow-callback="):
+                slow_callback = float(arg[arg.index("=") + 1:]) / 1e3
+        if profile:
+            profiler = Profiler(slow_callback, profile_report, profile_samples)
 
-        flags = (ECG_data_collection_flag, ACC_data_collection_flag, PPI_data_collection_flag, PPG_data_collection_flag, GYR_data_collection_flag, MAG_data_collection_flag)
+        ## Live metrics: --metrics=<Prometheus textfile> and/or --metrics-port=<port> (HTTP on localhost), --metrics-interval=<s>
+        metrics_path = None
+        metrics_port = None
+        metrics_interval = 5.0
+        for arg in args:
+            if arg.startswith("--metrics="):
+                metrics_path = arg[arg.index("=") + 1:]
+            elif arg.startswith("--metrics-port="):
+                metrics_port = int(arg[arg.index("=") + 1:])
+            elif arg.startswith("--metrics-interval="):
+                metrics_interval = float(arg[arg.index("=") + 1:])
 
-        if not flags.__contains__(True): 
+        if len(addresses) == 0:
+            print("No sensor address provided")
+            print("Exiting")
+        elif len(measurement_types) == 0: 
             print("No data type is set for collection.")
             print("Exiting")
         else:
-            try:
-                async with BleakClient(args[0]) as client:
-                #async with BleakClient(ADDRESS) as client:
-                    signal.signal(signal.SIGINT, keyboardInterrupt_handler)
-                    tasks = [
-                        asyncio.create_task(run(client, args[0], True)), # Use if Python 3.7+
-                        #asyncio.ensure_future(run(client, ADDRESS_DICT[args[0]], True)), # else ...
-                    ]
-    
-                    await asyncio.gather(*tasks)
-            except Exception as ex:
-                print(ex)
+            pipeline = IngestPipeline()
+            pipeline.start()
+            started = datetime.now().strftime('%Y%m%dT%H%M%S')
+            sessions = [
+                SensorSession(addr, [default_stream_settings[meas] for meas in measurement_types], f"data_{addr.replace(':','')}_{started}", pipeline)
+                for addr in addresses
+            ]
+            signal.signal(signal.SIGINT, keyboardInterrupt_handler)
+
+            if profiler is not None:
+                profiler.start(asyncio.get_running_loop())
+
+            exporter = None
+            if metrics_path is not None or metrics_port is not None:
+                exporter = asyncio.create_task(MetricsExporter(sessions, pipeline, metrics_path, metrics_port, metrics_interval).run())
+
+            ## Supervised session: a lost or failed connection is re-established with exponential backoff.
+            ## The session (buffers, counters, open outputs) outlives the connections.
+            async def collect(session: SensorSession) -> None:
+                failures = 0
+                while True:
+                    on_disconnect = partial(link_lost, session)
+                    connections = session.connections
+                    try:
+                        if simulate_speed is not None:
+                            client = SimulatedPolarClient(session.addr, speed=simulate_speed, replay=replay_log, disconnected_callback=on_disconnect, drop_interval=simulate_drop)
+                        else:
+                            client = BleakClient(session.addr, disconnected_callback=on_disconnect)
+                        async with client:
+                            await run(client, session, True)
+                        break
+                    except Exception as ex:
+                        print(f"{session.addr}: {ex}")
+                    failures = 0 if session.connections > connections else failures + 1
+                    if ctrl_stopp or session.stop_requested or (reconnect_attempts is not None and failures >= reconnect_attempts):
+                        break
+                    delay = min(reconnect_backoff[0] * 2 ** max(0, failures - 1), reconnect_backoff[1])
+                    print(f"{session.addr}: reconnecting in {delay:g} s")
+                    deadline = time.monotonic() + delay
+                    while not ctrl_stopp and time.monotonic() < deadline:
+                        await asyncio.sleep(min(0.5, deadline - time.monotonic()))
+                    if ctrl_stopp:
+                        break
+
+                # writing final datapoints and closing file handles (on the writer thread)
+                if session.raw_frame_log is not None:
+                    session.raw_frame_log.close()
+                    session.manifest.add_closed_files(None, [session.raw_frame_log.f.info()], None, None)
+                    session.manifest.save()
+                    print(f"{session.raw_frame_log.frames} raw frame(s) written to {session.raw_frame_log.path}")
+                else:
+                    try:
+                        await pipeline.detach(session)
+                    except RuntimeError as ex:
+                        print(f"ERROR: {session.addr}: outputs not closed, {ex}")
+                    print(f"{session.addr}: {session.received_frames} frame(s) received, {session.dropped_frames} dropped, {session.connections} connection(s)")
+
+            tasks = [asyncio.create_task(collect(session)) for session in sessions]
+            await asyncio.gather(*tasks)
+
+            await asyncio.get_running_loop().run_in_executor(None, pipeline.stop)
+            if exporter is not None:
+                exporter.cancel()
+                await asyncio.gather(exporter, return_exceptions=True)
+            print(pipeline.stats())
+            if profiler is not None:
+                profiler.finish(asyncio.get_running_loop())
+            print("[CLOSED] application closed.")
     else:
         print("No argument provided")
         print("Exiting")
 
 
 if __name__ == "__main__":
-    os.environ["PYTHONASYNCIODEBUG"] = str(1)
+    if "--debug" in sys.argv:
+        os.environ["PYTHONASYNCIODEBUG"] = str(1)
     loop = asyncio.new_event_loop()
     asyncio.set_event_loop(loop)
     loop.run_until_complete(main([sys.argv[i] for i in range(1, len(sys.argv)) if len(sys.argv) > 1]))
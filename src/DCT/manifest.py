@@ -0,0 +1,154 @@
+import hashlib, json, os
+
+""" Output manifest of the Data Collection Tool.
+
+Every recording session keeps {base}.manifest.json next to its output files. It describes the recorded
+streams and lists every output segment with its files and the first and last sensor timestamp it holds,
+so downstream tools can pick the segments of the time window they need without opening the others:
+
+    manifest = read_manifest("data_AABBCCDDEEFF_20220301T120000.manifest.json")
+    for segment in find_segments(manifest, "ECG", t0, t1): ...
+
+Output files are written through ChecksumFile, which keeps the SHA-256 and size of everything written so
+far. When a file is closed it is added to "files" with its size, checksum and the sensor time range it
+covers: an upload tool ships exactly the closed files, resumes partial uploads by their size and verifies
+them against the checksum, without reading anything that is still being written. Files written outside
+the segments (summary tiers, the raw frame log of a --raw capture) are listed in "open_files" from the
+moment they are created until they are closed.
+
+When the connection to the sensor is lost and re-established, recording continues in the same segments
+and the interruption is listed in "gaps": last sensor timestamp before it, first one after it and, for
+regularly sampled streams, the number of samples missed.
+
+The manifest is rewritten (atomically) whenever a segment or file is opened or closed and whenever a gap is added.
+"""
+
+MANIFEST_VERSION = 1
+
+
+def manifest_path(file_base_name: str) -> str:
+    return f"{file_base_name}.manifest.json"
+
+
+class OutputManifest:
+    def __init__(self, path: str, addr: str, settings: list, output: dict) -> None:
+        self.path = path
+        self.description = {
+            "version": MANIFEST_VERSION,
+            "address": addr,
+            "streams": {s.measurement_type: {"sample_freq": s.sample_freq, "resolution": s.resolution, "range": s.range} for s in settings},
+            "output": output,
+        }
+        self.segments = []
+        self.gaps = []
+        self.files = []
+        self.open_files = []
+
+    def add_open_files(self, files: list) -> None:
+        # Files being written outside the segments; listed until they are added as closed files
+        self.open_files += [os.path.basename(path) for path in files]
+        self.save()
+
+    def add_segment(self, measurement_type: str, index: int, files: list) -> dict:
+        segment = {
+            "measurement_type": measurement_type,
+            "index": index,
+            "files": [os.path.basename(path) for path in files],
+            "first_timestamp": None, # raw sensor timestamps [ns since 2000-01-01T00:00:00Z]
+            "last_timestamp": None,
+            "samples": 0,
+            "bytes": 0,
+            "closed": False,
+        }
+        self.segments.append(segment)
+        self.save()
+        return segment
+
+    def add_closed_files(self, measurement_type: str, files: list, first_timestamp: int, last_timestamp: int) -> None:
+        # files: ChecksumFile.info() of every file closed
+        for info in files:
+            if info["name"] in self.open_files:
+                self.open_files.remove(info["name"])
+            self.files.append(dict(info, measurement_type=measurement_type, first_timestamp=first_timestamp, last_timestamp=last_timestamp))
+
+    def add_gap(self, measurement_type: str, last_timestamp: int, first_timestamp: int, missing_samples: int = None) -> dict:
+        gap = {
+            "measurement_type": measurement_type,
+            "last_timestamp": last_timestamp, # last sample before the gap (None: nothing was received before it)
+            "first_timestamp": first_timestamp, # first sample after it
+            "missing_samples": missing_samples, # None for irregular streams (PPI)
+        }
+        self.gaps.append(gap)
+        self.save()
+        return gap
+
+    def save(self) -> None:
+        temp_path = f"{self.path}.tmp"
+        with open(temp_path, "w") as f:
+            json.dump(dict(self.description, segments=self.segments, gaps=self.gaps, files=self.files, open_files=self.open_files), f, indent=1)
+        os.replace(temp_path, self.path)
+
+
+class ChecksumFile:
+    # Append-only binary output file computing the SHA-256 of its content while it is written.
+    # Text is written UTF-8 encoded; bytes and numpy arrays as they are.
+    def __init__(self, path: str) -> None:
+        self.name = path
+        self.f = open(path, "wb")
+        self.sha256 = hashlib.sha256()
+        self.position = 0
+
+    def write(self, data) -> int:
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+        self.f.write(data)
+        self.sha256.update(data)
+        written = memoryview(data).nbytes
+        self.position += written
+        return written
+
+    def tell(self) -> int:
+        return self.position
+
+    def flush(self) -> None:
+        self.f.flush()
+
+    def fileno(self) -> int:
+        return self.f.fileno()
+
+    def close(self) -> None:
+        self.f.close()
+
+    def info(self) -> dict:
+        return {"name": os.path.basename(self.name), "bytes": self.position, "sha256": self.sha256.hexdigest()}
+
+
+def read_manifest(path: str) -> dict:
+    with open(path) as f:
+        manifest = json.load(f)
+    if manifest.get("version") != MANIFEST_VERSION:
+        raise ValueError(f"Unsupported manifest version in {path}")
+    return manifest
+
+## Segments of one stream holding samples in [t0, t1) (raw sensor timestamps), in recording order.
+## Segments that are not closed (still being written, or left by an interrupted recording) are always included:
+## their sample count and timestamps in the manifest are only updated when segments are opened or closed.
+def find_segments(manifest: dict, measurement_type: str, t0: int = None, t1: int = None) -> list:
+    return [
+        segment for segment in manifest["segments"]
+        if segment["measurement_type"] == measurement_type
+        and (not segment["closed"] or (
+            segment["samples"] > 0
+            and (t0 is None or segment["last_timestamp"] >= t0)
+            and (t1 is None or segment["first_timestamp"] < t1)
+        ))
+    ]
+
+## Recording gaps of one stream overlapping [t0, t1) (raw sensor timestamps)
+def find_gaps(manifest: dict, measurement_type: str, t0: int = None, t1: int = None) -> list:
+    return [
+        gap for gap in manifest.get("gaps", [])
+        if gap["measurement_type"] == measurement_type
+        and (t0 is None or gap["first_timestamp"] > t0)
+        and (t1 is None or gap["last_timestamp"] is None or gap["last_timestamp"] < t1)
+    ]
@@ -0,0 +1,173 @@
+import asyncio, math, os, time
+
+""" Live metrics of the Data Collection Tool.
+
+Counters are kept per stream (device, measurement type) by the writer thread and per device by the BLE
+callbacks. MetricsExporter periodically renders them in the Prometheus text format, derives per second
+rates and inter-arrival jitter over the last interval, and writes the result to a file (for the node
+exporter textfile collector) and/or serves it over HTTP on localhost.
+"""
+
+
+class StreamMetrics:
+    # Updated by the writer thread for every decoded frame and flush of one stream
+    def __init__(self, sample_period_ns: float = None) -> None:
+        self.sample_period_ns = sample_period_ns # None: irregular stream (PPI), no frame loss detection
+        self.frames = 0
+        self.samples = 0
+        self.parse_ns = 0
+        self.bytes_flushed = 0
+        self.interarrival_count = 0
+        self.interarrival_sum_ns = 0
+        self.interarrival_sumsq_ns = 0
+        self.lost_samples = 0
+        self.lost_frames = 0
+        self.last_arrival_ns = None
+        self.last_timestamp = None
+
+    def on_frame(self, arrival_ns: int, timestamp: int, samples: int, parse_ns: int) -> None:
+        self.frames += 1
+        self.samples += samples
+        self.parse_ns += parse_ns
+        if self.last_arrival_ns is not None:
+            interval = arrival_ns - self.last_arrival_ns
+            self.interarrival_count += 1
+            self.interarrival_sum_ns += interval
+            self.interarrival_sumsq_ns += interval * interval
+        self.last_arrival_ns = arrival_ns
+
+        # The sensor timestamp of a frame is the time of its last sample: the samples between two frames
+        # have to fill the time between the two timestamps, anything more is lost.
+        if self.sample_period_ns and self.last_timestamp is not None and samples > 0:
+            missing = round((timestamp - self.last_timestamp) / self.sample_period_ns) - samples
+            if missing > 0:
+                self.lost_samples += missing
+                self.lost_frames += math.ceil(missing / samples)
+        self.last_timestamp = timestamp
+
+
+class DeviceMetrics:
+    # Updated by the BLE callbacks of one device on the event loop
+    def __init__(self) -> None:
+        self.notifications = 0
+        self.callback_ns = 0
+        self.callback_max_ns = 0
+
+    def on_callback(self, duration_ns: int) -> None:
+        self.notifications += 1
+        self.callback_ns += duration_ns
+        if duration_ns > self.callback_max_ns:
+            self.callback_max_ns = duration_ns
+
+
+def format_labels(labels: dict) -> str:
+    return "{" + ",".join(f'{k}="{v}"' for k, v in labels.items()) + "}"
+
+
+class MetricsExporter:
+    def __init__(self, sessions: list, pipeline, path: str = None, port: int = None, interval: float = 5.0) -> None:
+        self.sessions = sessions
+        self.pipeline = pipeline
+        self.path = path
+        self.port = port
+        self.interval = interval
+        self.text = ""
+        self.previous = {}
+        self.previous_time = None
+        self.server = None
+
+    async def run(self) -> None:
+        if self.port is not None:
+            self.server = await asyncio.start_server(self.serve, "127.0.0.1", self.port)
+        try:
+            while True:
+                self.update()
+                await asyncio.sleep(self.interval)
+        finally:
+            self.update()
+            if self.server is not None:
+                self.server.close()
+
+    def update(self) -> None:
+        self.text = self.render()
+        if self.path is not None:
+            temp_path = f"{self.path}.tmp"
+            with open(temp_path, "w") as f:
+                f.write(self.text)
+            os.replace(temp_path, self.path) # readers never see a half written file
+
+    async def serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            await reader.readuntil(b"\r\n\r\n")
+            body = self.text.encode()
+            writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: text/plain; version=0.0.4\r\nConnection: close\r\n")
+            writer.write(f"Content-Length: {len(body)}\r\n\r\n".encode() + body)
+            await writer.drain()
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    def delta(self, key: tuple, value: float) -> float:
+        previous = self.previous.get(key, value if self.previous_time is None else 0)
+        self.previous[key] = value
+        return value - previous
+
+    def render(self) -> str:
+        now = time.monotonic()
+        elapsed = None if self.previous_time is None else now - self.previous_time
+        metrics = {} # name -> (type, help, [(labels, value)])
+
+        def add(name: str, kind: str, help: str, labels: dict, value: float) -> None:
+            metrics.setdefault(name, (kind, help, []))[2].append((labels, value))
+
+        def rate(key: tuple, value: float) -> float:
+            change = self.delta(key, value)
+            return change / elapsed if elapsed else 0.0
+
+        for session in self.sessions:
+            device = {"device": session.addr}
+            d = session.metrics
+            add("sense_notifications_total", "counter", "PMD data notifications received", device, d.notifications)
+            add("sense_notifications_per_second", "gauge", "PMD data notifications per second over the last interval", device, rate((session.addr, "notifications"), d.notifications))
+            add("sense_callback_seconds_total", "counter", "Time spent in the data notification callback", device, d.callback_ns / 1e9)
+            add("sense_callback_max_seconds", "gauge", "Longest data notification callback", device, d.callback_max_ns / 1e9)
+            add("sense_frames_dropped_total", "counter", "Frames dropped because the ingest queue was full", device, session.dropped_frames)
+
+            for meas, stream in session.streams.items():
+                labels = {"device": session.addr, "measurement": meas}
+                m = stream.metrics
+                key = (session.addr, meas)
+                add("sense_frames_total", "counter", "Frames decoded", labels, m.frames)
+                add("sense_frames_per_second", "gauge", "Frames decoded per second over the last interval", labels, rate(key + ("frames",), m.frames))
+                add("sense_samples_total", "counter", "Samples decoded", labels, m.samples)
+                add("sense_samples_per_second", "gauge", "Samples decoded per second over the last interval", labels, rate(key + ("samples",), m.samples))
+                add("sense_parse_seconds_total", "counter", "Time spent decoding frames", labels, m.parse_ns / 1e9)
+                add("sense_buffer_depth_samples", "gauge", "Decoded samples waiting to be written", labels, len(stream.buffer))
+                add("sense_bytes_flushed_total", "counter", "Bytes written to the output file(s)", labels, m.bytes_flushed)
+                add("sense_bytes_flushed_per_second", "gauge", "Bytes written per second over the last interval", labels, rate(key + ("bytes",), m.bytes_flushed))
+                add("sense_lost_samples_total", "counter", "Samples missing according to the sensor timestamps", labels, m.lost_samples)
+                add("sense_lost_frames_total", "counter", "Frames missing according to the sensor timestamps", labels, m.lost_frames)
+
+                count = self.delta(key + ("interarrival_count",), m.interarrival_count)
+                total = self.delta(key + ("interarrival_sum",), m.interarrival_sum_ns)
+                squares = self.delta(key + ("interarrival_sumsq",), m.interarrival_sumsq_ns)
+                mean = total / count if count > 0 else 0.0
+                jitter = math.sqrt(max(0.0, squares / count - mean * mean)) if count > 0 else 0.0
+                add("sense_frame_interarrival_seconds", "gauge", "Mean time between frames over the last interval", labels, mean / 1e9)
+                add("sense_frame_interarrival_jitter_seconds", "gauge", "Standard deviation of the time between frames over the last interval", labels, jitter / 1e9)
+
+        if self.pipeline is not None:
+            add("sense_ingest_queue_depth", "gauge", "Frames waiting in the ingest queue", {}, self.pipeline.frames.qsize())
+            add("sense_ingest_queue_peak_depth", "gauge", "Highest ingest queue depth seen", {}, self.pipeline.peak_depth)
+            add("sense_ingest_failed_frames_total", "counter", "Frames that could not be decoded", {}, self.pipeline.failed_frames)
+            add("sense_ingest_failed_flushes_total", "counter", "Flushes of a session output that failed (write errors)", {}, self.pipeline.failed_flushes)
+
+        self.previous_time = now
+        lines = []
+        for name, (kind, help, samples) in metrics.items():
+            lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, value in samples:
+                lines.append(f"{name}{format_labels(labels) if labels else ''} {value:g}")
+        return "\n".join(lines) + "\n"
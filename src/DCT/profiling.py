@@ -0,0 +1,162 @@
+import json, logging, os, sys, threading, time
+from collections import Counter
+
+""" Profiling mode of the Data Collection Tool (--profile).
+
+Production recordings run without asyncio debug mode and without per packet console output. When a
+recording stalls in the field, the same recording can be repeated with --profile, which adds:
+
+* slow callback tracing: asyncio debug mode with a callback duration threshold (--slow-callback=<ms>);
+  every event loop callback running longer is recorded with its duration
+* per stage timing histograms: BLE notification callback (receive), frame decoding (parse) and writer
+  thread flushes (flush), in power of two buckets
+* optionally a sampling profiler (--profile-samples=<file>): the stacks of all threads are sampled every
+  few milliseconds and written as folded stacks ("thread;frame;frame count" lines, for flamegraph.pl or
+  speedscope)
+
+The report is printed at the end of the recording and, with --profile=<file>, written as JSON.
+"""
+
+STAGES = ("receive", "parse", "flush")
+HISTOGRAM_BUCKETS = 48 # bucket i: durations of i bits [ns], i.e. up to 2**i ns (2**47 ns > 39 h)
+
+
+class StageHistogram:
+    # Durations of one stage; only ever updated by one thread
+    def __init__(self) -> None:
+        self.buckets = [0] * HISTOGRAM_BUCKETS
+        self.count = 0
+        self.total_ns = 0
+        self.max_ns = 0
+
+    def record(self, duration_ns: int) -> None:
+        self.buckets[min(duration_ns.bit_length(), HISTOGRAM_BUCKETS - 1)] += 1
+        self.count += 1
+        self.total_ns += duration_ns
+        if duration_ns > self.max_ns:
+            self.max_ns = duration_ns
+
+    def percentile(self, p: float) -> int:
+        # upper bound of the bucket holding the p-th percentile [ns]
+        rank = p / 100 * self.count
+        seen = 0
+        for i, n in enumerate(self.buckets):
+            seen += n
+            if n > 0 and seen >= rank:
+                return min(1 << i, self.max_ns)
+        return self.max_ns
+
+    def summary(self) -> dict:
+        return {
+            "count": self.count,
+            "mean_us": self.total_ns / self.count / 1e3 if self.count else 0.0,
+            "p50_us": self.percentile(50) / 1e3,
+            "p99_us": self.percentile(99) / 1e3,
+            "max_us": self.max_ns / 1e3,
+            "buckets_us": {f"{(1 << i) / 1e3:g}": n for i, n in enumerate(self.buckets) if n > 0}, # upper bound -> count
+        }
+
+
+class SlowCallbackHandler(logging.Handler):
+    # Receives asyncio's debug mode warnings "Executing <handle> took <seconds> seconds"
+    def __init__(self, events: list) -> None:
+        super().__init__(logging.WARNING)
+        self.events = events
+
+    def emit(self, record: logging.LogRecord) -> None:
+        if isinstance(record.msg, str) and record.msg.startswith("Executing") and len(record.args) == 2:
+            self.events.append({"time": record.created, "callback": str(record.args[0]), "seconds": float(record.args[1])})
+
+
+class StackSampler:
+    # Sampling profiler: a daemon thread counting the stacks of all other threads every interval seconds
+    def __init__(self, path: str, interval: float = 0.005) -> None:
+        self.path = path
+        self.interval = interval
+        self.stacks = Counter()
+        self.samples = 0
+        self.stopping = threading.Event()
+        self.thread = threading.Thread(target=self.sample, name="stack-sampler", daemon=True)
+
+    def start(self) -> None:
+        self.thread.start()
+
+    def sample(self) -> None:
+        own = threading.get_ident()
+        while not self.stopping.wait(self.interval):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                stack.append(names.get(ident, str(ident)))
+                self.stacks[";".join(reversed(stack))] += 1
+            self.samples += 1
+
+    def stop(self) -> None:
+        self.stopping.set()
+        self.thread.join()
+        with open(self.path, "w") as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+
+
+class Profiler:
+    def __init__(self, slow_callback: float = 0.05, report_path: str = None, samples_path: str = None) -> None:
+        self.slow_callback = slow_callback
+        self.report_path = report_path
+        self.stages = {stage: StageHistogram() for stage in STAGES}
+        self.slow_callbacks = []
+        self.handler = SlowCallbackHandler(self.slow_callbacks)
+        self.sampler = None if samples_path is None else StackSampler(samples_path)
+        self.started = None
+
+    def record(self, stage: str, duration_ns: int) -> None:
+        self.stages[stage].record(duration_ns)
+
+    def start(self, loop) -> None:
+        loop.set_debug(True)
+        loop.slow_callback_duration = self.slow_callback
+        logging.getLogger("asyncio").addHandler(self.handler)
+        if self.sampler is not None:
+            self.sampler.start()
+        self.started = time.monotonic()
+
+    def stop(self, loop) -> None:
+        loop.set_debug(False)
+        logging.getLogger("asyncio").removeHandler(self.handler)
+        if self.sampler is not None:
+            self.sampler.stop()
+
+    def report(self) -> dict:
+        slowest = sorted(self.slow_callbacks, key=lambda event: event["seconds"], reverse=True)
+        return {
+            "seconds": time.monotonic() - self.started,
+            "stages": {stage: histogram.summary() for stage, histogram in self.stages.items()},
+            "slow_callback_threshold": self.slow_callback,
+            "slow_callbacks": len(self.slow_callbacks),
+            "slowest_callbacks": slowest[:20],
+            "samples": None if self.sampler is None else {"path": self.sampler.path, "count": self.sampler.samples},
+        }
+
+    def print_report(self, report: dict) -> None:
+        print(f"Profile of {report['seconds']:.1f} s:")
+        for stage, s in report["stages"].items():
+            print(f"  {stage:8} {s['count']:9d} x  mean {s['mean_us']:9.1f} µs  p50 <= {s['p50_us']:9.1f} µs  p99 <= {s['p99_us']:9.1f} µs  max {s['max_us']:9.1f} µs")
+        print(f"  {report['slow_callbacks']} event loop callback(s) slower than {report['slow_callback_threshold'] * 1e3:g} ms")
+        for event in report["slowest_callbacks"][:5]:
+            print(f"    {event['seconds'] * 1e3:8.1f} ms  {event['callback']}")
+        if report["samples"] is not None:
+            print(f"  {report['samples']['count']} stack samples written to {report['samples']['path']}")
+
+    def finish(self, loop) -> None:
+        self.stop(loop)
+        report = self.report()
+        self.print_report(report)
+        if self.report_path is not None:
+            with open(self.report_path, "w") as f:
+                json.dump(report, f, indent=1)
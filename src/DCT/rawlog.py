@@ -0,0 +1,85 @@
+import json, mmap, struct, time
+
+""" Raw PMD frame log of the Data Collection Tool (--raw capture mode).
+
+Every data notification is appended undecoded, prefixed by its length and host arrival time, so a
+capture never depends on the frame parsers. The file starts with a JSON description of the recorded
+streams (settings used to start them). Decoding happens offline with "main.py decode <log file>".
+"""
+
+RAW_LOG_MAGIC = b"SENSEPMD"
+RAW_LOG_VERSION = 1
+RAW_LOG_FILE_HEADER = struct.Struct("<8sHI") # magic, version, length of the JSON settings that follow
+RAW_LOG_RECORD_HEADER = struct.Struct("<IQ") # frame length, arrival time [ns since epoch, host clock]
+
+
+class RawFrameLog:
+    # opener: opens the log for binary writing (default: open(path, "wb")).
+    def __init__(self, path: str, addr: str, settings: list, opener=None) -> None:
+        self.path = path
+        self.frames = 0
+        self.f = open(path, "wb") if opener is None else opener(path)
+        description = json.dumps({
+            "address": addr,
+            "streams": {s.measurement_type: {"sample_freq": s.sample_freq, "resolution": s.resolution, "range": s.range} for s in settings},
+        }).encode()
+        self.f.write(RAW_LOG_FILE_HEADER.pack(RAW_LOG_MAGIC, RAW_LOG_VERSION, len(description)))
+        self.f.write(description)
+
+    def append(self, data: bytes) -> None:
+        self.f.write(RAW_LOG_RECORD_HEADER.pack(len(data), time.time_ns()))
+        self.f.write(data)
+        self.frames += 1
+
+    def flush(self) -> None:
+        self.f.flush()
+
+    def close(self) -> None:
+        self.f.close()
+
+
+def read_raw_log_header(f) -> tuple:
+    magic, version, description_length = RAW_LOG_FILE_HEADER.unpack(f.read(RAW_LOG_FILE_HEADER.size))
+    if magic != RAW_LOG_MAGIC or version != RAW_LOG_VERSION:
+        raise ValueError(f"{f.name} is not a raw PMD frame log")
+    description = json.loads(f.read(description_length))
+    return description, RAW_LOG_FILE_HEADER.size + description_length
+
+## Yields (arrival time, frame) for every complete record in data (a chunk of the record area)
+def iter_raw_log_records(data: bytes):
+    data = memoryview(data)
+    position = 0
+    while position + RAW_LOG_RECORD_HEADER.size <= len(data):
+        length, arrival = RAW_LOG_RECORD_HEADER.unpack_from(data, position)
+        position += RAW_LOG_RECORD_HEADER.size
+        if position + length > len(data):
+            return
+        yield arrival, data[position : position + length]
+        position += length
+
+## Splits the record area of a raw log into chunks of about chunk_size bytes on record boundaries.
+## Only the record headers are read; a truncated record at the end (interrupted capture) is left out.
+def split_raw_log(path: str, chunk_size: int) -> tuple:
+    with open(path, "rb") as f:
+        description, offset = read_raw_log_header(f)
+        size = f.seek(0, 2)
+        if size == offset:
+            return description, []
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    chunks = []
+    start = position = offset
+    try:
+        while position + RAW_LOG_RECORD_HEADER.size <= size:
+            length, _ = RAW_LOG_RECORD_HEADER.unpack_from(data, position)
+            end = position + RAW_LOG_RECORD_HEADER.size + length
+            if end > size:
+                break
+            position = end
+            if position - start >= chunk_size:
+                chunks.append((start, position))
+                start = position
+    finally:
+        data.close()
+    if position > start:
+        chunks.append((start, position))
+    return description, chunks
@@ -0,0 +1,70 @@
+import json, os, struct
+
+""" On-disk cache of the PMD capabilities of every sensor.
+
+The first session with a sensor reads its PMD feature bits and asks the control point for the supported
+settings of every requested measurement type (op code 0x01, get measurement settings). The responses are
+kept in {cache dir}/pmd_{address without colons}.json, so later sessions start streaming right away:
+
+    {"address": "AA:BB:CC:DD:EE:FF", "features": "0f0500", "settings": {"ECG": "f0010000000001820001010e00"}}
+
+The raw responses are stored as hex; parse_settings_response() turns one into {setting type: [values]}.
+"""
+
+CACHE_VERSION = 1
+
+## Setting types of the get measurement settings response
+SETTING_NAMES = {
+    0x00: "sample rate",
+    0x01: "resolution",
+    0x02: "range",
+    0x03: "range (milliunit)",
+    0x04: "channels",
+    0x05: "conversion factor",
+}
+
+## Size of one value of every setting type [bytes]; the conversion factor is a 32 bit float
+SETTING_FIELD_SIZES = {0x00: 2, 0x01: 2, 0x02: 2, 0x03: 4, 0x04: 1, 0x05: 4, 0x06: 16}
+
+
+def cache_path(cache_dir: str, addr: str) -> str:
+    return os.path.join(cache_dir, f"pmd_{addr.replace(':', '')}.json")
+
+def load_cache(cache_dir: str, addr: str) -> dict:
+    try:
+        with open(cache_path(cache_dir, addr)) as f:
+            cache = json.load(f)
+        if cache.get("version") == CACHE_VERSION and cache.get("address") == addr:
+            return cache
+    except (OSError, ValueError):
+        pass
+    return {"version": CACHE_VERSION, "address": addr, "settings": {}}
+
+def save_cache(cache_dir: str, cache: dict) -> None:
+    os.makedirs(cache_dir, exist_ok=True)
+    path = cache_path(cache_dir, cache["address"])
+    # written next to the cache and renamed: sessions started at the same time never read half a file
+    with open(f"{path}.tmp", "w") as f:
+        json.dump(cache, f, indent=1)
+    os.replace(f"{path}.tmp", path)
+
+## Supported settings of a get measurement settings response: 0xF0, 0x01, measurement type, error code,
+## more frames, then per setting type: type, value count, values (little endian, SETTING_FIELD_SIZES bytes each).
+## Parsing stops at a setting type of unknown size, the values after it cannot be located.
+def parse_settings_response(data: bytes) -> dict:
+    settings = {}
+    parameters = data[5:]
+    offset = 0
+    while offset + 2 <= len(parameters):
+        setting_type, count = parameters[offset], parameters[offset + 1]
+        size = SETTING_FIELD_SIZES.get(setting_type)
+        if size is None or offset + 2 + size * count > len(parameters):
+            break
+        offset += 2
+        fields = [parameters[offset + size * i : offset + size * (i + 1)] for i in range(count)]
+        if setting_type == 0x05:
+            settings[setting_type] = [struct.unpack("<f", field)[0] for field in fields]
+        else:
+            settings[setting_type] = [int.from_bytes(field, "little") for field in fields]
+        offset += size * count
+    return settings
@@ -0,0 +1,337 @@
+import asyncio, time
+import numpy as np
+from datetime import datetime, timezone
+from bleak.uuids import uuid16_dict
+from rawlog import iter_raw_log_records, read_raw_log_header
+from settingscache import SETTING_FIELD_SIZES
+
+""" Simulated Polar sensor standing in for BleakClient.
+
+Implements the part of the BleakClient interface used by the Data Collection Tool (read_gatt_char,
+start_notify, write_gatt_char, stop_notify, is_connected and the async context manager). The simulated
+device answers PMD control point commands with 0xF0 responses and streams synthetic PMD data frames
+for every started measurement, or replays the frames of a raw PMD log (--raw capture).
+
+speed scales the frame rate relative to real time; sensor timestamps always advance at the nominal
+sampling period, so a recording made at speed 50 looks like a 50 times longer real recording.
+"""
+
+uuid16_dict_reversed = {v: k for k, v in uuid16_dict.items()}
+
+## Device side view of the characteristics used by main.py
+MODEL_NBR_UUID = "0000{0:x}-0000-1000-8000-00805f9b34fb".format(uuid16_dict_reversed.get("Model Number String"))
+MANUFACTURER_NAME_UUID = "0000{0:x}-0000-1000-8000-00805f9b34fb".format(uuid16_dict_reversed.get("Manufacturer Name String"))
+BATTERY_LEVEL_UUID = "0000{0:x}-0000-1000-8000-00805f9b34fb".format(uuid16_dict_reversed.get("Battery Level"))
+PMD_CONTROL = "FB005C81-02E7-F387-1CAD-8ACD2D8DF0C8"
+PMD_DATA = "FB005C82-02E7-F387-1CAD-8ACD2D8DF0C8"
+
+MEAS_CODES = {"ECG": 0x00, "PPG": 0x01, "ACC": 0x02, "PPI": 0x03, "GYR": 0x05, "MAG": 0x06}
+MEAS_TYPES = {v: k for k, v in MEAS_CODES.items()}
+
+## Control point error codes used by the simulator
+SUCCESS = 0
+INVALID_MEASUREMENT_TYPE = 2
+INVALID_PARAMETER = 5
+ALREADY_IN_STATE = 6
+
+## Settings reported by the "get measurement settings" command: setting type -> supported values
+SUPPORTED_SETTINGS = {
+    "ECG": {0x00: (130,), 0x01: (14,)},
+    "PPG": {0x00: (55, 130, 135), 0x01: (14, 22), 0x04: (4,)},
+    "ACC": {0x00: (25, 50, 100, 130, 200), 0x01: (14, 16), 0x02: (2, 4, 8), 0x04: (3,)},
+    "PPI": {},
+    "GYR": {0x00: (52, 100, 130, 200), 0x01: (14, 16), 0x02: (250, 500, 1000, 2000), 0x04: (3,)},
+    "MAG": {0x00: (10, 20, 50, 100), 0x01: (14, 16), 0x02: (50,), 0x04: (3,)},
+}
+
+## Samples per data frame, as sent by the sensors with the default MTU
+SAMPLES_PER_FRAME = {"ECG": 73, "PPG": 18, "ACC": 36, "GYR": 36, "MAG": 36}
+
+TIMESTAMP_BASE = datetime(2000, 1, 1, tzinfo=timezone.utc)
+
+
+def sensor_time_now() -> int:
+    # nanoseconds since 2000-01-01T00:00:00Z
+    return (time.time_ns() - int(TIMESTAMP_BASE.timestamp()) * 1_000_000_000)
+
+## Sensor clock of every simulated device: (sensor timestamp, time.monotonic()) when it was first connected
+sensor_clocks = {}
+
+def encode_frame(meas_type: str, timestamp: int, frame_type: int, payload: bytes) -> bytes:
+    return bytes([MEAS_CODES[meas_type]]) + timestamp.to_bytes(8, "little") + bytes([frame_type]) + payload
+
+def encode_int24(values: np.ndarray) -> bytes:
+    return np.ascontiguousarray(values, dtype="<i4").view(np.uint8).reshape(-1, 4)[:, :3].tobytes()
+
+def encode_ECG_frame(values: np.ndarray, timestamp: int) -> bytes:
+    return encode_frame("ECG", timestamp, 0x00, encode_int24(values))
+
+def encode_PPG_frame(channels: np.ndarray, timestamp: int) -> bytes:
+    # channels: (samples, 4) -> ppg0, ppg1, ppg2, ambient as 24 bit values
+    return encode_frame("PPG", timestamp, 0x00, encode_int24(np.asarray(channels).ravel()))
+
+def encode_xyz_frame(meas_type: str, channels: np.ndarray, timestamp: int) -> bytes:
+    # channels: (samples, 3) -> uncompressed 16 bit x, y, z (ACC frame type 0x01)
+    return encode_frame(meas_type, timestamp, 0x01, np.ascontiguousarray(channels, dtype="<i2").tobytes())
+
+def encode_signed(values: np.ndarray, sample_bytes: int) -> bytes:
+    if sample_bytes == 3:
+        return encode_int24(values)
+    return np.ascontiguousarray(values, dtype=f"<i{sample_bytes}").tobytes()
+
+def encode_delta_frame(meas_type: str, channels: np.ndarray, timestamp: int, resolution: int, block_size: int = 16) -> bytes:
+    # Delta compressed frame (type 0x80): reference sample, then blocks of bit packed deltas of the smallest width
+    channels = np.asarray(channels, dtype=np.int64)
+    payload = bytearray(encode_signed(channels[0], (resolution + 7) // 8))
+    deltas = np.diff(channels, axis=0)
+    for start in range(0, len(deltas), block_size):
+        block = deltas[start : start + block_size]
+        width = int(np.abs(block).max()).bit_length() + 1 # including the sign bit
+        bits = (block.reshape(-1, 1) >> np.arange(width)) & 1
+        payload += bytes([width, len(block)]) + np.packbits(bits.astype(np.uint8).ravel(), bitorder="little").tobytes()
+    return encode_frame(meas_type, timestamp, 0x80, bytes(payload))
+
+def encode_PPI_frame(bpm: int, peak_interval: int, error_estimate: int, flags: int, timestamp: int) -> bytes:
+    payload = bytes([bpm]) + peak_interval.to_bytes(2, "little") + error_estimate.to_bytes(2, "little") + bytes([flags])
+    return encode_frame("PPI", timestamp, 0x00, payload)
+
+
+## Synthetic signals, t: sample times [s]
+def synthetic_ECG(t: np.ndarray, heart_rate: float = 62.0) -> np.ndarray:
+    phase = (t * heart_rate / 60.0) % 1.0
+    wave = (
+        120 * np.exp(-((phase - 0.20) / 0.025) ** 2)     # P
+        - 150 * np.exp(-((phase - 0.34) / 0.008) ** 2)   # Q
+        + 1200 * np.exp(-((phase - 0.36) / 0.010) ** 2)  # R
+        - 250 * np.exp(-((phase - 0.38) / 0.010) ** 2)   # S
+        + 300 * np.exp(-((phase - 0.60) / 0.050) ** 2)   # T
+    )
+    return (wave + 40 * np.sin(2 * np.pi * 0.25 * t)).astype(np.int32) # with respiration baseline wander
+
+def synthetic_PPG(t: np.ndarray, heart_rate: float = 62.0) -> np.ndarray:
+    pulse = np.sin(2 * np.pi * heart_rate / 60.0 * t)
+    ppg = 200000 + 15000 * pulse
+    return np.stack([ppg, ppg * 0.95, ppg * 1.05, np.full(len(t), 1200.0)], axis=1).astype(np.int32)
+
+def synthetic_motion(t: np.ndarray, amplitude: float = 1000.0) -> np.ndarray:
+    return np.stack([
+        amplitude * np.sin(2 * np.pi * 0.5 * t),
+        amplitude * np.cos(2 * np.pi * 0.3 * t),
+        amplitude * 0.1 * np.sin(2 * np.pi * 1.7 * t) + amplitude,
+    ], axis=1).astype(np.int16)
+
+
+class SimulatedStream:
+    # Frame source of one started measurement. ECG, PPG and ACC are sent uncompressed,
+    # GYR and MAG as delta compressed frames like the Polar Verity Sense does.
+    def __init__(self, meas_type: str, sample_freq: int, start_time: int, resolution: int = 16) -> None:
+        self.meas_type = meas_type
+        self.sample_freq = sample_freq
+        self.resolution = resolution
+        self.start_time = start_time
+        self.samples_per_frame = SAMPLES_PER_FRAME.get(meas_type, 1)
+        self.frames = 0
+
+    def frame_duration(self) -> float:
+        # sensor time covered by one frame [s]
+        if self.meas_type == "PPI":
+            return 60.0 / 62.0
+        return self.samples_per_frame / self.sample_freq
+
+    def next_frame(self) -> bytes:
+        if self.meas_type == "PPI":
+            timestamp = self.start_time + int((self.frames + 1) * self.frame_duration() * 1e9)
+            self.frames += 1
+            return encode_PPI_frame(62, 968, 10, 0x06, timestamp)
+
+        first = self.frames * self.samples_per_frame
+        index = np.arange(first, first + self.samples_per_frame)
+        t = index / self.sample_freq
+        timestamp = self.start_time + int(index[-1] * 1e9 / self.sample_freq)
+        self.frames += 1
+        if self.meas_type == "ECG":
+            return encode_ECG_frame(synthetic_ECG(t), timestamp)
+        if self.meas_type == "PPG":
+            return encode_PPG_frame(synthetic_PPG(t), timestamp)
+        if self.meas_type == "ACC":
+            return encode_xyz_frame(self.meas_type, synthetic_motion(t), timestamp)
+        return encode_delta_frame(self.meas_type, synthetic_motion(t), timestamp, self.resolution)
+
+
+class SimulatedPolarClient:
+    def __init__(self, address: str, speed: float = 1.0, replay: str = None, battery_level: int = 87, model: str = "Polar H10 (simulated)",
+                 latency: float = 0.03, disconnected_callback=None, drop_interval: float = None) -> None:
+        self.address = address
+        self.latency = latency # round trip of one GATT request, a few connection intervals
+        self.speed = speed
+        self.replay = replay
+        self.device_info = {
+            MODEL_NBR_UUID.lower(): model.encode(),
+            MANUFACTURER_NAME_UUID.lower(): b"Polar Electro Oy",
+            BATTERY_LEVEL_UUID.lower(): bytes([battery_level]),
+        }
+        self.callbacks = {}
+        self.streams = {}
+        self.connected = False
+        self.frames_sent = 0
+        self.disconnected_callback = disconnected_callback
+        self.drop_interval = drop_interval # the link is lost this many seconds after every connect
+        self.dropper = None
+        # the sensor clock keeps running between connections (at speed times real time)
+        self.clock_origin = sensor_clocks.setdefault(address, (sensor_time_now(), time.monotonic()))
+
+    async def __aenter__(self) -> "SimulatedPolarClient":
+        await self.connect()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb) -> None:
+        await self.disconnect()
+
+    async def connect(self) -> bool:
+        self.connected = True
+        if self.drop_interval is not None:
+            self.dropper = asyncio.create_task(self.drop_link())
+        return True
+
+    async def disconnect(self) -> bool:
+        if self.dropper is not None:
+            self.dropper.cancel()
+        for task in self.streams.values():
+            task.cancel()
+        self.streams.clear()
+        self.callbacks.clear()
+        self.connected = False
+        return True
+
+    async def drop_link(self) -> None:
+        # Simulated link loss: the sensor stops its measurements and the client is told it is disconnected
+        await asyncio.sleep(self.drop_interval)
+        self.dropper = None
+        await self.disconnect()
+        if self.disconnected_callback is not None:
+            self.disconnected_callback(self)
+
+    def check_connected(self) -> None:
+        if not self.connected:
+            raise ConnectionError(f"Device {self.address} is not connected")
+
+    def sensor_time(self) -> int:
+        timestamp, monotonic = self.clock_origin
+        return timestamp + int((time.monotonic() - monotonic) * self.speed * 1e9)
+
+    async def is_connected(self) -> bool:
+        return self.connected
+
+    async def read_gatt_char(self, char_specifier, **kwargs) -> bytearray:
+        await asyncio.sleep(self.latency)
+        self.check_connected()
+        uuid = str(char_specifier).lower()
+        if uuid == PMD_CONTROL.lower():
+            # PMD feature read: 0x0F followed by the bit mask of supported measurement types
+            return bytearray([0x0F, sum(1 << code for code in MEAS_CODES.values()), 0x00])
+        return bytearray(self.device_info[uuid])
+
+    async def start_notify(self, char_specifier, callback, **kwargs) -> None:
+        await asyncio.sleep(self.latency) # client characteristic configuration write
+        self.callbacks[str(char_specifier).lower()] = callback
+
+    async def stop_notify(self, char_specifier) -> None:
+        self.callbacks.pop(str(char_specifier).lower(), None)
+
+    async def write_gatt_char(self, char_specifier, data: bytes, response: bool = False) -> None:
+        await asyncio.sleep(self.latency)
+        self.check_connected()
+        if str(char_specifier).lower() != PMD_CONTROL.lower():
+            return
+        op_code, meas_code = data[0], data[1]
+        meas_type = MEAS_TYPES.get(meas_code)
+        if meas_type is None:
+            self.respond(op_code, meas_code, INVALID_MEASUREMENT_TYPE)
+        elif op_code == 0x01:
+            self.respond(op_code, meas_code, SUCCESS, self.encode_settings(meas_type))
+        elif op_code == 0x02:
+            if meas_type in self.streams:
+                self.respond(op_code, meas_code, ALREADY_IN_STATE)
+                return
+            settings = self.decode_settings(data[2:])
+            sample_freq = settings.get(0x00, 1)
+            resolution = settings.get(0x01, 16)
+            if meas_type != "PPI" and sample_freq not in SUPPORTED_SETTINGS[meas_type][0x00]:
+                self.respond(op_code, meas_code, INVALID_PARAMETER)
+                return
+            self.respond(op_code, meas_code, SUCCESS)
+            self.streams[meas_type] = asyncio.create_task(self.stream(meas_type, sample_freq, resolution))
+        elif op_code == 0x03:
+            task = self.streams.pop(meas_type, None)
+            if task is None:
+                self.respond(op_code, meas_code, ALREADY_IN_STATE)
+                return
+            task.cancel()
+            self.respond(op_code, meas_code, SUCCESS)
+
+    def respond(self, op_code: int, meas_code: int, error: int, parameters: bytes = b"") -> None:
+        callback = self.callbacks.get(PMD_CONTROL.lower())
+        if callback is not None:
+            asyncio.get_running_loop().call_soon(callback, PMD_CONTROL, bytearray([0xF0, op_code, meas_code, error, 0x00]) + parameters)
+
+    def encode_settings(self, meas_type: str) -> bytes:
+        parameters = bytearray()
+        for setting_type, values in SUPPORTED_SETTINGS[meas_type].items():
+            parameters.append(setting_type)
+            parameters.append(len(values))
+            for value in values:
+                parameters += value.to_bytes(SETTING_FIELD_SIZES[setting_type], "little")
+        return bytes(parameters)
+
+    def decode_settings(self, data: bytes) -> dict:
+        settings = {}
+        offset = 0
+        while offset + 2 <= len(data):
+            setting_type, count = data[offset], data[offset + 1]
+            size = SETTING_FIELD_SIZES.get(setting_type, 2)
+            offset += 2
+            settings[setting_type] = int.from_bytes(data[offset : offset + size], "little")
+            offset += size * count
+        return settings
+
+    def notify_data(self, frame: bytes) -> None:
+        callback = self.callbacks.get(PMD_DATA.lower())
+        if callback is not None:
+            callback(PMD_DATA, bytearray(frame))
+            self.frames_sent += 1
+
+    async def stream(self, meas_type: str, sample_freq: int, resolution: int) -> None:
+        if self.replay is not None:
+            await self.replay_stream(meas_type)
+            return
+        loop = asyncio.get_running_loop()
+        source = SimulatedStream(meas_type, sample_freq, self.sensor_time(), resolution)
+        interval = source.frame_duration() / self.speed
+        start = loop.time()
+        while True:
+            # catch up with every frame that is due, then sleep until the next one
+            while source.frames * interval <= loop.time() - start:
+                self.notify_data(source.next_frame())
+            await asyncio.sleep(max(0.0, start + source.frames * interval - loop.time()))
+
+    async def replay_stream(self, meas_type: str) -> None:
+        loop = asyncio.get_running_loop()
+        with open(self.replay, "rb") as f:
+            read_raw_log_header(f)
+            data = f.read()
+        start = loop.time()
+        first_arrival = None
+        for arrival, frame in iter_raw_log_records(data):
+            if frame[0] != MEAS_CODES[meas_type]:
+                continue
+            if first_arrival is None:
+                first_arrival = arrival
+            delay = start + (arrival - first_arrival) / 1e9 / self.speed - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            self.notify_data(bytes(frame))
+
+
+def simulated_addresses(count: int) -> list:
+    # Distinct fake MAC addresses for multi sensor simulations
+    return [f"5E:00:00:00:{i >> 8:02X}:{i & 0xFF:02X}" for i in range(count)]
@@ -0,0 +1,138 @@
+import json, struct
+import numpy as np
+from manifest import ChecksumFile
+
+""" Summary tiers of the Data Collection Tool (--summary).
+
+While recording, the writer thread keeps min, max, mean and sample count of every value column per
+window of sensor time (1 s, 10 s and 60 s by default) for each stream, so a viewer can draw an overview
+of a long recording from a few thousand rows and only load raw samples when zoomed in.
+
+Every flushed block is aggregated into the finest tier; windows it completes are written and fed to
+the next tier, which aggregates them in turn. No sample is ever looked at twice. Windows are aligned to
+multiples of their length in sensor time. Tier files, {base}.{MEAS}.summary.{window}s.bin, hold a JSON
+description followed by fixed size records:
+
+    description, summary = read_summary("data_AABBCCDDEEFF_20220301T120000.ECG.summary.10s.bin")
+    summary["start"], summary["count"], summary["min"][:, 0], summary["max"][:, 0], summary["mean"][:, 0]
+"""
+
+SUMMARY_MAGIC = b"SENSESUM"
+SUMMARY_VERSION = 1
+SUMMARY_FILE_HEADER = struct.Struct("<8sHI") # magic, version, length of the JSON description that follows
+
+
+def summary_path(file_base_name: str, measurement_type: str, window: float) -> str:
+    return f"{file_base_name}.{measurement_type}.summary.{window:g}s.bin"
+
+def summary_dtype(channels: int) -> np.dtype:
+    # start of the window [raw sensor timestamp, ns], sample count, per value column min, max and mean
+    return np.dtype([("start", "<i8"), ("count", "<i8"), ("min", "<f8", (channels,)), ("max", "<f8", (channels,)), ("mean", "<f8", (channels,))])
+
+## Aggregates consecutive rows with equal keys (keys sorted): key, count, min, max, sum per group
+def aggregate(keys: np.ndarray, counts: np.ndarray, mins: np.ndarray, maxs: np.ndarray, sums: np.ndarray) -> tuple:
+    starts = np.flatnonzero(np.concatenate(([True], keys[1:] != keys[:-1])))
+    return (
+        keys[starts],
+        np.add.reduceat(counts, starts),
+        np.minimum.reduceat(mins, starts, axis=0),
+        np.maximum.reduceat(maxs, starts, axis=0),
+        np.add.reduceat(sums, starts, axis=0),
+    )
+
+
+class SummaryTier:
+    def __init__(self, path: str, measurement_type: str, window: float, columns: list) -> None:
+        self.path = path
+        self.window_ns = int(window * 1e9)
+        self.dtype = summary_dtype(len(columns))
+        self.pending = None # aggregates of the window still being filled
+        self.f = ChecksumFile(path)
+        description = json.dumps({"measurement_type": measurement_type, "window": window, "columns": columns}).encode()
+        self.f.write(SUMMARY_FILE_HEADER.pack(SUMMARY_MAGIC, SUMMARY_VERSION, len(description)))
+        self.f.write(description)
+
+    def add(self, starts: np.ndarray, counts: np.ndarray, mins: np.ndarray, maxs: np.ndarray, sums: np.ndarray) -> tuple:
+        # Adds rows of a finer resolution (or raw samples, count 1). Returns the windows completed by them.
+        rows = list(aggregate(starts // self.window_ns * self.window_ns, counts, mins, maxs, sums))
+        if self.pending is not None:
+            if self.pending[0][0] == rows[0][0]:
+                first = self.pending
+                rows[1][0] += first[1][0]
+                rows[2][0] = np.minimum(rows[2][0], first[2][0])
+                rows[3][0] = np.maximum(rows[3][0], first[3][0])
+                rows[4][0] += first[4][0]
+            else:
+                rows = [np.concatenate((p, r)) for p, r in zip(self.pending, rows)]
+        self.pending = tuple(column[-1:] for column in rows)
+        completed = tuple(column[:-1] for column in rows)
+        self.write(completed)
+        return completed
+
+    def write(self, rows: tuple) -> None:
+        starts, counts, mins, maxs, sums = rows
+        if len(starts) == 0:
+            return
+        records = np.empty(len(starts), dtype=self.dtype)
+        records["start"], records["count"], records["min"], records["max"] = starts, counts, mins, maxs
+        records["mean"] = sums / counts[:, None]
+        self.f.write(records.tobytes())
+
+    def finish(self) -> tuple:
+        # The window still being filled is complete at the end of the recording
+        pending, self.pending = self.pending, None
+        if pending is not None:
+            self.write(pending)
+        return pending
+
+
+class StreamSummary:
+    # All tiers of one stream. columns: names of the value columns of the sample buffer (all but the timestamps)
+    def __init__(self, file_base_name: str, measurement_type: str, columns: list, windows: tuple) -> None:
+        self.first_timestamp = None
+        self.last_timestamp = None
+        self.tiers = [SummaryTier(summary_path(file_base_name, measurement_type, window), measurement_type, window, columns) for window in sorted(windows)]
+
+    def add(self, block: tuple) -> None:
+        timestamps = block[-1]
+        if len(timestamps) == 0:
+            return
+        if self.first_timestamp is None:
+            self.first_timestamp = int(timestamps[0])
+        self.last_timestamp = int(timestamps[-1])
+        values = np.column_stack(block[:-1]).astype(np.float64)
+        rows = (timestamps, np.ones(len(timestamps), dtype=np.int64), values, values, values)
+        for tier in self.tiers:
+            rows = tier.add(*rows)
+            if len(rows[0]) == 0:
+                break
+
+    def flush(self) -> None:
+        for tier in self.tiers:
+            tier.f.flush()
+
+    def paths(self) -> list:
+        return [tier.path for tier in self.tiers]
+
+    def close(self) -> list:
+        # Returns ChecksumFile.info() of the closed tier files
+        rows = None
+        for tier in self.tiers:
+            # windows completed by the rows of the finer tier, then the one still being filled, go to the next tier
+            parts = [tier.add(*rows)] if rows is not None else []
+            parts.append(tier.finish())
+            parts = [part for part in parts if part is not None and len(part[0]) > 0]
+            rows = tuple(np.concatenate(column) for column in zip(*parts)) if len(parts) > 0 else None
+            tier.f.close()
+        return [tier.f.info() for tier in self.tiers]
+
+
+def read_summary(path: str) -> tuple:
+    with open(path, "rb") as f:
+        magic, version, description_length = SUMMARY_FILE_HEADER.unpack(f.read(SUMMARY_FILE_HEADER.size))
+        if magic != SUMMARY_MAGIC or version != SUMMARY_VERSION:
+            raise ValueError(f"{path} is not a SenSe summary file")
+        description = json.loads(f.read(description_length))
+        data = f.read()
+    dtype = summary_dtype(len(description["columns"]))
+    return description, np.frombuffer(data, dtype=dtype, count=len(data) // dtype.itemsize)
@@ -0,0 +1,25 @@
+import os
+import numpy as np
+import pytest
+
+import main
+from columnar import COLUMN_HEADER_SIZE, BinaryStreamWriter, ColumnHeader, open_stream
+
+""" Binary column files: header round trip and column names. """
+
+
+def test_long_column_names_round_trip(tmp_path) -> None:
+    # the PPI column names are up to 22 characters long
+    base = os.path.join(tmp_path, "data")
+    settings = main.default_stream_settings["PPI"]
+    writer = BinaryStreamWriter(base, 0x03, settings, main.PPI_binary_columns)
+    writer.write(tuple(np.arange(3) for _ in main.PPI_binary_columns))
+    writer.close()
+    assert sorted(open_stream(base, "PPI")) == sorted(name for name, _ in main.PPI_binary_columns)
+
+def test_header_fields_must_fit() -> None:
+    header = ColumnHeader(0x00, 14, 130, 0, "<i4", "x" * 42)
+    assert len(header.pack()) == COLUMN_HEADER_SIZE
+    assert ColumnHeader.unpack(header.pack()).column == "x" * 42
+    with pytest.raises(ValueError):
+        ColumnHeader(0x00, 14, 130, 0, "<i4", "x" * 43).pack()
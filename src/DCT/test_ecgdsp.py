@@ -0,0 +1,36 @@
+import numpy as np
+import pytest
+
+from ecgdsp import RPeakDetector
+from simulator import synthetic_ECG
+
+""" RPeakDetector must give the same R-peaks however the ECG is split into blocks. """
+
+SAMPLE_FREQ = 130
+
+
+def noisy_ECG() -> tuple:
+    # 150 s of synthetic ECG with an amplitude drop, a pause and an artifact, so the level decays several times
+    t = np.arange(SAMPLE_FREQ * 150) / SAMPLE_FREQ
+    ecg = synthetic_ECG(t, 72.0).astype(np.float64)
+    ecg[40 * SAMPLE_FREQ : 46 * SAMPLE_FREQ] *= 0.2
+    ecg[80 * SAMPLE_FREQ : 84 * SAMPLE_FREQ] = 0
+    ecg[100 * SAMPLE_FREQ] += 30000
+    ecg += np.random.default_rng(1).normal(0, 20, len(ecg))
+    return ecg, (t * 1e9).astype(np.int64)
+
+def detect(ecg: np.ndarray, timestamps: np.ndarray, block_size: int) -> tuple:
+    detector = RPeakDetector(SAMPLE_FREQ)
+    blocks = [detector.process(ecg[i : i + block_size], timestamps[i : i + block_size]) for i in range(0, len(ecg), block_size)]
+    return tuple(np.concatenate([block[column] for block in blocks]) for column in range(3))
+
+
+@pytest.mark.parametrize("block_size", [1, 5, 20, 73, 730, 4096])
+def test_peaks_independent_of_block_size(block_size: int) -> None:
+    ecg, timestamps = noisy_ECG()
+    rr, hr, peaks = detect(ecg, timestamps, len(ecg))
+    assert len(peaks) > 150
+    blocked = detect(ecg, timestamps, block_size)
+    np.testing.assert_array_equal(blocked[2], peaks)
+    np.testing.assert_array_equal(blocked[0], rr)
+    np.testing.assert_array_equal(blocked[1], hr)
@@ -0,0 +1,45 @@
+import asyncio, os
+import pytest
+import main
+from simulator import encode_frame
+
+""" Writer thread side of a recording session: decoding frames into the sample buffers and flushing them. """
+
+
+def test_flush_header_only_frame(tmp_path) -> None:
+    # a PPI frame without intervals decodes to zero samples; flushing it alone must not fail
+    base = os.path.join(tmp_path, "data")
+    session = main.SensorSession("5E:00:00:00:00:01", [main.default_stream_settings["PPI"]], base)
+    session.open_outputs()
+    session.decode(encode_frame("PPI", 1000, 0x00, b""), 0)
+    session.flush()
+    session.decode(encode_frame("PPI", 2000, 0x00, bytes([60, 0xE8, 0x03, 0x05, 0x00, 0x06])), 0)
+    session.flush()
+    session.close_outputs()
+    with open(f"{base}.PPI.csv") as f:
+        rows = f.read().splitlines()
+    assert len(rows) == 2 and rows[1].split(",")[1:4] == ['"60"', '"1000"', '"5"']
+
+def test_write_error_does_not_stop_the_writer_thread(tmp_path) -> None:
+    session = main.SensorSession("5E:00:00:00:00:01", [main.default_stream_settings["ECG"]], os.path.join(tmp_path, "data"))
+    session.open_outputs()
+    def full_disk() -> None:
+        raise OSError(28, "No space left on device")
+    session.flush = full_disk
+    pipeline = main.IngestPipeline(flush_interval=0.05)
+    pipeline.attach(session)
+    pipeline.start()
+    async def record() -> None:
+        await asyncio.sleep(0.2)
+        assert pipeline.running()
+        await pipeline.detach(session)
+    asyncio.run(record())
+    pipeline.stop()
+    assert pipeline.failed_flushes >= 2 and session.failed_flushes == pipeline.failed_flushes
+
+def test_detach_fails_fast_without_writer_thread(tmp_path) -> None:
+    session = main.SensorSession("5E:00:00:00:00:01", [main.default_stream_settings["ECG"]], os.path.join(tmp_path, "data"))
+    pipeline = main.IngestPipeline(max_frames=1)
+    pipeline.frames.put_nowait((session, b"", 0)) # full queue, never drained
+    with pytest.raises(RuntimeError):
+        asyncio.run(asyncio.wait_for(pipeline.detach(session), 5))
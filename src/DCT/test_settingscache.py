@@ -0,0 +1,14 @@
+from settingscache import parse_settings_response
+
+""" Parsing of get measurement settings responses. """
+
+
+def test_channels_are_one_byte() -> None:
+    # Polar H10 ACC: sample rate 200, resolution 16, channels 3 (1 byte), range 2/4/8 G
+    response = bytes([0xF0, 0x01, 0x02, 0x00, 0x00, 0x00, 0x01, 0xC8, 0x00, 0x01, 0x01, 0x10, 0x00,
+                      0x04, 0x01, 0x03, 0x02, 0x03, 0x02, 0x00, 0x04, 0x00, 0x08, 0x00])
+    assert parse_settings_response(response) == {0x00: [200], 0x01: [16], 0x04: [3], 0x02: [2, 4, 8]}
+
+def test_unknown_setting_type_stops_parsing() -> None:
+    response = bytes([0xF0, 0x01, 0x00, 0x00, 0x00, 0x00, 0x01, 0x82, 0x00, 0x7F, 0x01, 0x01, 0x01, 0x01, 0x0E, 0x00])
+    assert parse_settings_response(response) == {0x00: [130]}
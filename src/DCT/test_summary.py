@@ -0,0 +1,37 @@
+import os
+import numpy as np
+
+from simulator import synthetic_ECG
+from summary import StreamSummary, read_summary, summary_path
+
+""" The summary tiers must hold the same windows as aggregating all samples at once. """
+
+SAMPLE_FREQ = 130
+WINDOWS = (1, 10, 60)
+
+
+def test_tiers_match_direct_aggregation(tmp_path) -> None:
+    # 205.5 s of ECG in random block sizes, starting in the middle of a 60 s window and ending in the first second
+    # of a 10 s window: closing completes windows of every tier
+    timestamps = 725_000_000_000 + np.arange(int(SAMPLE_FREQ * 205.5), dtype=np.int64) * 1_000_000_000 // SAMPLE_FREQ
+    values = synthetic_ECG(np.arange(len(timestamps)) / SAMPLE_FREQ)
+    base = os.path.join(tmp_path, "data")
+    summary = StreamSummary(base, "ECG", ["ecg"], WINDOWS)
+    rng = np.random.default_rng(3)
+    start = 0
+    while start < len(timestamps):
+        end = start + int(rng.integers(1, 600))
+        summary.add((values[start:end], timestamps[start:end]))
+        start = end
+    summary.close()
+
+    for window in WINDOWS:
+        window_ns = window * 1_000_000_000
+        keys = timestamps // window_ns * window_ns
+        starts = np.flatnonzero(np.concatenate(([True], keys[1:] != keys[:-1])))
+        _, tier = read_summary(summary_path(base, "ECG", window))
+        np.testing.assert_array_equal(tier["start"], keys[starts])
+        np.testing.assert_array_equal(tier["count"], np.diff(np.append(starts, len(keys))))
+        np.testing.assert_array_equal(tier["min"][:, 0], np.minimum.reduceat(values, starts))
+        np.testing.assert_array_equal(tier["max"][:, 0], np.maximum.reduceat(values, starts))
+        np.testing.assert_allclose(tier["mean"][:, 0], np.add.reduceat(values.astype(np.float64), starts) / tier["count"])
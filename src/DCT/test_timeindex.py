@@ -0,0 +1,28 @@
+import os
+import numpy as np
+import pytest
+
+import main
+from simulator import encode_ECG_frame
+from timeindex import CSV_TIMESTAMP_COLUMN, read_window
+
+""" Windowed reads of recordings, including ones still being written. """
+
+
+@pytest.mark.parametrize("output_format", ["csv", "bin"])
+def test_read_window_of_running_recording(tmp_path, monkeypatch, output_format: str) -> None:
+    monkeypatch.setattr(main, "output_format", output_format)
+    base = os.path.join(tmp_path, "data")
+    session = main.SensorSession("5E:00:00:00:00:01", [main.default_stream_settings["ECG"]], base)
+    session.open_outputs()
+    for i in range(5):
+        # frames of 73 samples, timestamp of the last sample
+        session.decode(encode_ECG_frame(np.arange(73, dtype=np.int32) + 73 * i, 1_000_000_000 * (i + 1)), 0)
+        session.flush()
+    # not closed: the manifest still holds the segment as it was when it was opened
+    timestamp_column = CSV_TIMESTAMP_COLUMN if output_format == "csv" else "timestamp"
+    timestamps = read_window(base, "ECG")[timestamp_column]
+    assert len(timestamps) == 5 * 73
+    t0, t1 = int(timestamps[100]), int(timestamps[200])
+    assert len(read_window(base, "ECG", t0, t1)[timestamp_column]) == 100
+    session.close_outputs()
@@ -0,0 +1,124 @@
+import csv, io, os, struct
+import numpy as np
+from columnar import open_stream
+from compression import codec_from_path, decompress, open_decompressed
+from manifest import ChecksumFile, find_segments, manifest_path, read_manifest
+
+""" Time range index and windowed reads of recorded streams.
+
+The CSV writers keep a sparse sidecar index, {csv file}.idx, with one entry per written block (about one
+per second): first and last raw sensor timestamp, byte offset and length of the block's rows and their
+sample count. Reading a time window seeks straight to the blocks overlapping it instead of scanning the
+file. In compressed CSV files (--compress) every block is a frame of its own and the index holds its
+compressed offset and length. Binary column files need no index, their timestamp column is memory mapped
+and binary searched.
+
+    window = read_window("data_AABBCCDDEEFF_20220301T120000", "ECG", t0, t1)
+    window["Sensor timestamp [raw]"], window["Voltage [µV]"]
+"""
+
+INDEX_MAGIC = b"SENSEIDX"
+INDEX_VERSION = 1
+INDEX_HEADER = struct.Struct("<8sHH4x") # magic, version, entry size
+INDEX_ENTRY_DTYPE = np.dtype([("first_timestamp", "<i8"), ("last_timestamp", "<i8"), ("offset", "<u8"), ("length", "<u8"), ("samples", "<u8")])
+
+CSV_TIMESTAMP_COLUMN = "Sensor timestamp [raw]"
+
+
+def index_path(path: str) -> str:
+    return f"{path}.idx"
+
+
+class TimeIndexWriter:
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.f = ChecksumFile(path)
+        self.f.write(INDEX_HEADER.pack(INDEX_MAGIC, INDEX_VERSION, INDEX_ENTRY_DTYPE.itemsize))
+
+    def append(self, first_timestamp: int, last_timestamp: int, offset: int, length: int, samples: int) -> None:
+        self.f.write(np.array([(first_timestamp, last_timestamp, offset, length, samples)], dtype=INDEX_ENTRY_DTYPE).tobytes())
+
+    def flush(self) -> None:
+        self.f.flush()
+
+    def sync(self) -> None:
+        self.f.flush()
+        os.fsync(self.f.fileno())
+
+    def close(self) -> None:
+        self.f.close()
+
+
+def read_index(path: str) -> np.ndarray:
+    with open(path, "rb") as f:
+        magic, version, entry_size = INDEX_HEADER.unpack(f.read(INDEX_HEADER.size))
+        if magic != INDEX_MAGIC or version != INDEX_VERSION or entry_size != INDEX_ENTRY_DTYPE.itemsize:
+            raise ValueError(f"{path} is not a SenSe time index")
+        data = f.read()
+    # an entry cut short by an interrupted recording is left out
+    return np.frombuffer(data, dtype=INDEX_ENTRY_DTYPE, count=len(data) // INDEX_ENTRY_DTYPE.itemsize)
+
+def parse_csv_value(value: str):
+    if value == "True" or value == "False":
+        return value == "True"
+    try:
+        return int(value)
+    except ValueError:
+        return value
+
+## Samples of one CSV file with t0 <= raw timestamp < t1, as a dict of column name -> array
+def read_csv_window(path: str, t0: int = None, t1: int = None) -> dict:
+    entries = read_index(index_path(path))
+    selected = np.ones(len(entries), dtype=bool)
+    if t0 is not None:
+        selected &= entries["last_timestamp"] >= t0
+    if t1 is not None:
+        selected &= entries["first_timestamp"] < t1
+    codec = codec_from_path(path)
+    with open_decompressed(path) as f:
+        header = next(csv.reader([f.readline().decode()]), None)
+    if not header:
+        return {} # nothing written yet
+    with open(path, "rb") as f:
+        rows = []
+        for entry in entries[selected]:
+            f.seek(int(entry["offset"]))
+            data = f.read(int(entry["length"]))
+            if codec is not None:
+                data = decompress(codec, data)
+            rows += csv.reader(io.StringIO(data.decode()))
+    columns = {name: np.array([parse_csv_value(row[i]) for row in rows]) for i, name in enumerate(header)}
+    if len(rows) > 0:
+        timestamps = columns[CSV_TIMESTAMP_COLUMN]
+        keep = np.ones(len(timestamps), dtype=bool)
+        if t0 is not None:
+            keep &= timestamps >= t0
+        if t1 is not None:
+            keep &= timestamps < t1
+        columns = {name: values[keep] for name, values in columns.items()}
+    return columns
+
+## Samples of one binary recording (column files {file_base_name}.{MEAS}.*.bin) with t0 <= timestamp < t1
+def read_binary_window(file_base_name: str, measurement_type: str, t0: int = None, t1: int = None) -> dict:
+    columns = open_stream(file_base_name, measurement_type)
+    timestamps = columns["timestamp"]
+    start = 0 if t0 is None else np.searchsorted(timestamps, t0, side="left")
+    end = len(timestamps) if t1 is None else np.searchsorted(timestamps, t1, side="left")
+    return {name: np.array(values[start:end]) for name, values in columns.items()}
+
+## Samples of one stream of a recording (all its segments) with t0 <= raw sensor timestamp < t1. Segments still
+## being written are read up to their last complete index entry or row.
+def read_window(file_base_name: str, measurement_type: str, t0: int = None, t1: int = None) -> dict:
+    manifest = read_manifest(manifest_path(file_base_name))
+    directory = os.path.dirname(file_base_name)
+    parts = []
+    for segment in find_segments(manifest, measurement_type, t0, t1):
+        first_file = os.path.join(directory, segment["files"][0])
+        if manifest["output"]["format"] == "bin":
+            parts.append(read_binary_window(first_file.rsplit(f".{measurement_type}.", 1)[0], measurement_type, t0, t1))
+        else:
+            parts.append(read_csv_window(first_file, t0, t1))
+    parts = [part for part in parts if len(part) > 0]
+    if len(parts) == 0:
+        return {}
+    return {name: np.concatenate([part[name] for part in parts]) for name in parts[0]}
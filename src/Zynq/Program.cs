@@ -4,7 +4,10 @@ using System.Linq;
 using System.Collections.Generic;
 using System.Threading.Tasks;
 using System.Text;
+using System.Text.Json;
+using System.Security.Cryptography;
 using Renci.SshNet;
+using Renci.SshNet.Sftp;
 
 namespace Zynq;
 
@@ -34,7 +37,7 @@ class Program
     }
     static async Task Main(string[] args)
     {
-        if (ParseArgs(args, out string remote, out string source, out string keyPath)) return;
+        if (ParseArgs(args, out string remote, out string source, out string keyPath, out TimeSpan staleAfter)) return;
 
         if (string.IsNullOrEmpty(remote))
         {
@@ -87,15 +90,69 @@ class Program
             client.Connect();
             client.ChangeDirectory(rInfo.Path);
 
+            var closedFiles = new Dictionary<string, ManifestFile>();
+            var openFiles = new HashSet<string>();
+            ReadManifests(source, closedFiles, openFiles, staleAfter);
+
+            var remoteFiles = client.ListDirectory(client.WorkingDirectory)
+                .Where(f => f.IsRegularFile)
+                .ToDictionary(f => f.Name, f => f);
+
+            int uploaded = 0, resumed = 0, upToDate = 0, writing = 0, failed = 0;
+            long uploadedBytes = 0;
             foreach (string filePath in sourceFiles)
             {
                 string fileName = Path.GetFileName(filePath);
+                if (fileName.EndsWith(".tmp"))
+                    continue;
 
-                using var sourceStream = new FileStream(filePath, FileMode.Open, FileAccess.Read, FileShare.Read);
-                using var remoteStream = client.Create(fileName);
+                remoteFiles.TryGetValue(fileName, out SftpFile? remoteFile);
+                long remoteLength = remoteFile?.Length ?? 0;
 
-                await sourceStream.CopyToAsync(remoteStream);
+                long offset = 0;
+                if (closedFiles.TryGetValue(fileName, out ManifestFile? closed))
+                {
+                    // Closed recording file: complete once the remote copy has its size, resumed where a previous run stopped
+                    if (remoteFile != null && remoteLength == closed.Bytes)
+                    {
+                        upToDate++;
+                        continue;
+                    }
+                    if (remoteLength < closed.Bytes)
+                        offset = remoteLength;
+                }
+                else if (openFiles.Contains(fileName))
+                {
+                    // Still being written by the collector, shipped once it is closed
+                    writing++;
+                    continue;
+                }
+                else
+                {
+                    // Not described by a manifest (the manifests themselves, files of interrupted recordings, ...): uploaded when changed
+                    var info = new FileInfo(filePath);
+                    if (remoteFile != null && remoteLength == info.Length && remoteFile.LastWriteTimeUtc >= info.LastWriteTimeUtc)
+                    {
+                        upToDate++;
+                        continue;
+                    }
+                }
+
+                long sent = await UploadAsync(client, filePath, fileName, offset, closed);
+                if (sent < 0)
+                {
+                    failed++;
+                    continue;
+                }
+                if (offset > 0)
+                    resumed++;
+                else
+                    uploaded++;
+                uploadedBytes += sent;
             }
+
+            Console.WriteLine("{0} file(s) uploaded, {1} resumed ({2} bytes), {3} up to date, {4} still being written, {5} failed",
+                uploaded, resumed, uploadedBytes, upToDate, writing, failed);
         }
         catch (Exception ex)
         {
@@ -103,6 +160,126 @@ class Program
         }
     }
 
+    // Closed output file listed in a DCT recording manifest (<base>.manifest.json, "files")
+    class ManifestFile
+    {
+        public string Name { get; init; }
+        public long Bytes { get; init; }
+        public string Sha256 { get; init; }
+
+        public ManifestFile(string name, long bytes, string sha256)
+        {
+            Name = name;
+            Bytes = bytes;
+            Sha256 = sha256;
+        }
+    }
+
+    // Open files of a recording that stopped without closing them (crash, power loss) are never closed: when neither
+    // the manifest nor any of them changed for staleAfter, they are left out of openFiles and uploaded as they are.
+    private static void ReadManifests(string source, Dictionary<string, ManifestFile> closedFiles, HashSet<string> openFiles, TimeSpan staleAfter)
+    {
+        foreach (string manifestPath in Directory.GetFiles(source, "*.manifest.json"))
+            try
+            {
+                using JsonDocument manifest = JsonDocument.Parse(File.ReadAllBytes(manifestPath));
+                JsonElement root = manifest.RootElement;
+                var open = new List<string>();
+
+                if (root.TryGetProperty("files", out JsonElement files))
+                    foreach (JsonElement file in files.EnumerateArray())
+                    {
+                        var closed = new ManifestFile(
+                            name: file.GetProperty("name").GetString()!,
+                            bytes: file.GetProperty("bytes").GetInt64(),
+                            sha256: file.GetProperty("sha256").GetString()!
+                        );
+                        closedFiles[closed.Name] = closed;
+                    }
+
+                // Written outside the segments (summary tiers, raw captures) and not closed yet
+                if (root.TryGetProperty("open_files", out JsonElement openOutside))
+                    foreach (JsonElement file in openOutside.EnumerateArray())
+                        open.Add(file.GetString()!);
+
+                if (root.TryGetProperty("segments", out JsonElement segments))
+                    foreach (JsonElement segment in segments.EnumerateArray())
+                        if (!segment.GetProperty("closed").GetBoolean())
+                            foreach (JsonElement file in segment.GetProperty("files").EnumerateArray())
+                                open.Add(file.GetString()!);
+
+                // A running recording writes its open files every second
+                DateTime lastChange = open
+                    .Select(name => Path.Combine(source, name))
+                    .Where(File.Exists)
+                    .Select(File.GetLastWriteTimeUtc)
+                    .Append(File.GetLastWriteTimeUtc(manifestPath))
+                    .Max();
+                if (open.Count > 0 && DateTime.UtcNow - lastChange > staleAfter)
+                    Console.WriteLine("{0}: unchanged since {1:u}, the recording was interrupted: uploading its {2} open file(s) as they are",
+                        Path.GetFileName(manifestPath), lastChange, open.Count);
+                else
+                    openFiles.UnionWith(open);
+            }
+            catch (Exception ex)
+            {
+                Console.WriteLine("Error: {0}: {1}", manifestPath, ex.Message);
+            }
+    }
+
+    // Uploads a file from offset on (the remote copy holds everything before it). Closed recording files are
+    // verified against their manifest checksum: the part uploaded before is read back from the server, the rest
+    // is hashed as it is sent. Returns the bytes sent, -1 on failure.
+    private static async Task<long> UploadAsync(SftpClient client, string filePath, string fileName, long offset, ManifestFile? expected)
+    {
+        using var sourceStream = new FileStream(filePath, FileMode.Open, FileAccess.Read, FileShare.ReadWrite);
+        using var sha256 = IncrementalHash.CreateHash(HashAlgorithmName.SHA256);
+        long length = expected?.Bytes ?? sourceStream.Length;
+        byte[] buffer = new byte[1 << 16];
+
+        long position = 0;
+        if (offset > 0)
+        {
+            using var remotePrefix = client.OpenRead(fileName);
+            while (position < offset)
+            {
+                int read = await remotePrefix.ReadAsync(buffer, 0, (int)Math.Min(buffer.Length, offset - position));
+                if (read == 0)
+                    break;
+                sha256.AppendData(buffer, 0, read);
+                position += read;
+            }
+            position = offset;
+            sourceStream.Seek(offset, SeekOrigin.Begin);
+        }
+
+        using (var remoteStream = offset > 0 ? client.Open(fileName, FileMode.Open, FileAccess.Write) : client.Create(fileName))
+        {
+            remoteStream.Seek(offset, SeekOrigin.Begin);
+            while (position < length)
+            {
+                int read = await sourceStream.ReadAsync(buffer, 0, (int)Math.Min(buffer.Length, length - position));
+                if (read == 0)
+                    break;
+                sha256.AppendData(buffer, 0, read);
+                await remoteStream.WriteAsync(buffer, 0, read);
+                position += read;
+            }
+        }
+
+        if (expected != null)
+        {
+            string checksum = Convert.ToHexString(sha256.GetHashAndReset()).ToLowerInvariant();
+            if (position != expected.Bytes || checksum != expected.Sha256)
+            {
+                Console.WriteLine("Error: {0}: does not match its manifest (size or checksum), remote copy removed", fileName);
+                client.DeleteFile(fileName);
+                return -1;
+            }
+        }
+        return position - offset;
+    }
+
     private static PrivateKeyFile[]? GetKeyFiles()
     {
         string? homepath = GetHomePath();
@@ -136,9 +313,10 @@ class Program
         return pkFile.ToArray();
     }
 
-    private static bool ParseArgs(string[] args, out string remote, out string source, out string keyPath)
+    private static bool ParseArgs(string[] args, out string remote, out string source, out string keyPath, out TimeSpan staleAfter)
     {
         string r = string.Empty, s = string.Empty, k = string.Empty;
+        TimeSpan stale = TimeSpan.FromMinutes(10);
 
         bool argError = false;
         foreach (string arg in args)
@@ -150,6 +328,8 @@ class Program
                     s = arg.Substring(arg.IndexOf('=') + 1).Trim(' ', '\'', '\"', '\n', '\t');
                 else if (arg.StartsWith("--key=") && string.IsNullOrEmpty(k))
                     k = arg.Substring(arg.IndexOf('=') + 1).Trim(' ', '\'', '\"', '\n', '\t');
+                else if (arg.StartsWith("--stale-after="))
+                    stale = TimeSpan.FromMinutes(double.Parse(arg.Substring(arg.IndexOf('=') + 1), System.Globalization.CultureInfo.InvariantCulture));
                 else
                 {
                     Console.WriteLine("Illegal argument: {0}", arg);
@@ -161,7 +341,7 @@ class Program
                 argError = true;
             }
 
-        (remote, source, keyPath) = (r, s, k);
+        (remote, source, keyPath, staleAfter) = (r, s, k, stale);
 
         return argError;
     }